@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+""" Throughput of the batch endpoints of DBApi compared to doing the same
+work one call at a time.
+
+Usage: python benchmarks/bench_batch.py [number of items]
+"""
+from __future__ import absolute_import
+
+import sys
+import time
+from datetime import datetime
+
+from simpleapi import DummyClient, Route
+
+from kinoknecht.api import DBApi
+from kinoknecht.database import engine, init_db, shutdown_db
+from kinoknecht.models import Videofile
+
+client = DummyClient(Route(DBApi, framework='dummy'))
+
+
+def populate(count):
+    """ Inserts count videofiles without touching the filesystem """
+    now = datetime.now()
+    engine.execute(Videofile.__table__.insert(), [
+        dict(name=u'Show.S%02dE%02d.avi' % (i // 100 + 1, i % 100),
+             path=u'/srv/video/Show', size=1024, creation_date=now,
+             sha1hash=u'%040x' % i)
+        for i in range(count)])
+
+
+def timed(label, count, func):
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    print "%-30s %8.3fs %10.1f items/s" % (label, elapsed, count / elapsed)
+
+
+def run(count):
+    init_db()
+    populate(count * 2)
+
+    # One episode per videofile, first half one call each, second half
+    # in a single batch
+    timed('create (one by one)', count, lambda: [
+        client.create(category='episode', vfiles=[i], title='Episode')
+        for i in range(1, count + 1)])
+    timed('create_many', count, lambda: client.create_many(items=[
+        dict(category='episode', vfiles=[i], title='Episode')
+        for i in range(count + 1, 2 * count + 1)]))
+
+    client.create(category='show', title='Show')
+    client.create(category='show', title='Other Show')
+    timed('add_to_show (one by one)', count, lambda: [
+        client.add_to_show(showid=1, episodes=[i])
+        for i in range(1, count + 1)])
+    timed('assign_many', count, lambda: client.assign_many(
+        category='show', assignments=[[2, range(count + 1, 2 * count + 1)]]))
+
+    timed('delete_many', count, lambda: client.delete_many(
+        category='episode', ids=range(1, count + 1)))
+    shutdown_db()
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+""" Load test for the production server: measures the latency of player
+commands while the library is being scanned in the background.
+
+Usage: python benchmarks/bench_concurrency.py [number of files]
+"""
+from __future__ import absolute_import
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import synthlib
+from harness import FakeVideoStream
+
+
+class FakePlayer(object):
+    """ Stand-in for the mplayer instance, answers right away """
+    time_pos = 0
+
+    def loadfile(self, path):
+        pass
+
+    def pause(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def seek(self, position):
+        pass
+
+    def sub_load(self, path):
+        pass
+
+
+def percentiles(values):
+    values = sorted(values)
+    pick = lambda p: values[min(len(values) - 1, int(len(values) * p))]
+    return "n=%4d  p50=%7.2fms  p95=%7.2fms  max=%7.2fms" % (
+        len(values), pick(0.5) * 1000, pick(0.95) * 1000, values[-1] * 1000)
+
+
+def measure(client, until):
+    latencies = []
+    while not until():
+        start = time.time()
+        client.pause()
+        latencies.append(time.time() - start)
+    return latencies
+
+
+def run(count):
+    workdir = tempfile.mkdtemp(prefix='kinoknecht-load-')
+    libdir = os.path.join(workdir, 'library')
+    print "Generating %d files" % count
+    synthlib.generate_library(libdir, count)
+
+    from kinoknecht import config
+    config.video_dirs = [libdir]
+    config.db_address = 'sqlite:///%s' % os.path.join(workdir, 'kk.db')
+    logging.getLogger('kinoknecht').setLevel(logging.WARNING)
+
+    import kinoknecht.models
+    import kinoknecht.api
+    kinoknecht.models.VideoStream = FakeVideoStream
+    kinoknecht.api.player = FakePlayer()
+    from kinoknecht.database import init_db
+    from kinoknecht.server import create_server
+    from kinoknecht.scheduler import scheduler
+    from simpleapi import Client
+
+    init_db()
+    scheduler.start()
+    server = create_server('127.0.0.1', 0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    base = 'http://127.0.0.1:%d' % server.server_address[1]
+    player = Client(ns=base + '/api/player/')
+    db = Client(ns=base + '/api/db/')
+
+    deadline = time.time() + 2
+    print "idle:         ", percentiles(measure(
+        player, lambda: time.time() > deadline))
+
+    jobid = db.update_database(background=True)
+    status = {'running': True}
+
+    def poll():
+        while (db.job_status(jobid=jobid)['status']
+               in ('queued', 'running')):
+            time.sleep(0.2)
+        status['running'] = False
+    poller = threading.Thread(target=poll)
+    poller.start()
+    start = time.time()
+    print "during scan:  ", percentiles(measure(
+        player, lambda: not status['running']))
+    print "scan took %.1fs" % (time.time() - start)
+
+    server.shutdown()
+    shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -* coding: utf8 -*-
+""" Accuracy and throughput of the filename parser and the title index.
+
+The corpus in filenames.tsv lists real-world filenames together with the
+values the parser is expected to extract. Accuracy is reported for the
+default mode, which the scanner and get_clean_name use, and for the
+episode mode (is_episode), which Episode and match_titles for shows use.
+Neither knows the expected values.
+
+Usage: python benchmarks/bench_nameparser.py [number of names]
+"""
+from __future__ import absolute_import
+
+import codecs
+import os
+import random
+import sys
+import time
+
+from kinoknecht.nameparser import parse_name, parse_names, TitleIndex
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'filenames.tsv')
+# Number of fuzzy lookups, these are a lot slower than parsing
+LOOKUPS = 2000
+FIELDS = ('title', 'year', 'season', 'episode', 'part')
+
+
+def load_corpus():
+    corpus = []
+    with codecs.open(CORPUS, encoding='utf8') as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                continue
+            values = line.rstrip('\n').split('\t')
+            expected = [values[1]] + [int(v) if v else None
+                                      for v in values[2:6]]
+            corpus.append((values[0], dict(zip(FIELDS, expected))))
+    return corpus
+
+
+def accuracy(corpus, is_episode=False):
+    print "%s mode:" % ('episode' if is_episode else 'default')
+    hits = dict((field, 0) for field in FIELDS)
+    complete = 0
+    for (fname, expected) in corpus:
+        parsed = parse_name(fname, is_episode)._asdict()
+        correct = [f for f in FIELDS if parsed[f] == expected[f]]
+        for field in correct:
+            hits[field] += 1
+        if len(correct) == len(FIELDS):
+            complete += 1
+        else:
+            print "  mismatch: %s -> %s" % (fname, dict(
+                (f, parsed[f]) for f in FIELDS if f not in correct))
+    for field in FIELDS:
+        print "%-10s %5.1f%%" % (field, 100.0 * hits[field] / len(corpus))
+    print "%-10s %5.1f%%" % ('all', 100.0 * complete / len(corpus))
+
+
+def throughput(corpus, count):
+    # Make every name unique, so parse_names can't take shortcuts
+    names = [u'%s %d%s' % (os.path.splitext(fname)[0], idx,
+                           os.path.splitext(fname)[1])
+             for (idx, (fname, _)) in
+             enumerate(corpus[i % len(corpus)] for i in range(count))]
+    start = time.time()
+    parsed = parse_names(names)
+    elapsed = time.time() - start
+    print "parse_names: %d names in %.2fs (%.0f names/s)" % (
+        count, elapsed, count / elapsed)
+
+    rng = random.Random(0)
+    words = list(set(w for (_, e) in corpus for w in e['title'].split()))
+    index = TitleIndex((i, u' '.join(rng.sample(words, rng.randint(1, 4))))
+                       for i in range(count))
+    start = time.time()
+    for p in parsed[:LOOKUPS]:
+        index.match(p.title)
+    elapsed = time.time() - start
+    print "TitleIndex.match: %d lookups in %d titles in %.2fs (%.0f/s)" % (
+        min(count, LOOKUPS), count, elapsed, min(count, LOOKUPS) / elapsed)
+
+
+if __name__ == '__main__':
+    corpus = load_corpus()
+    accuracy(corpus)
+    accuracy(corpus, is_episode=True)
+    throughput(corpus, int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+""" Lookup and update times of the similarity index for a large synthetic
+library, with or without NumPy (whichever is installed).
+
+Usage: python benchmarks/bench_similarity.py [number of titles]
+"""
+from __future__ import absolute_import
+
+import random
+import sys
+import time
+
+from kinoknecht import similarity
+
+GENRES = ['action', 'adventure', 'animation', 'comedy', 'crime',
+          'documentary', 'drama', 'family', 'fantasy', 'horror', 'music',
+          'mystery', 'romance', 'sci-fi', 'thriller', 'war', 'western']
+
+
+def run(count):
+    rng = random.Random(0)
+    index = similarity.SimilarityIndex()
+    start = time.time()
+    for idx in range(count):
+        index.set(idx, rng.sample(GENRES, rng.randint(1, 3)),
+                  rng.randint(1920, 2011), rng.uniform(1, 10),
+                  rng.randint(70, 200), rng.randint(0, 20))
+    elapsed = time.time() - start
+    print "numpy: %s" % (similarity.numpy is not None)
+    print "build:  %d titles in %.2fs" % (count, elapsed)
+
+    lookups = 200
+    start = time.time()
+    for _ in range(lookups):
+        index.similar(rng.randrange(count), limit=10)
+    elapsed = time.time() - start
+    print "lookup: %.2fms per query" % (elapsed / lookups * 1000)
+
+    start = time.time()
+    for _ in range(lookups):
+        index.set(rng.randrange(count), rng.sample(GENRES, 2), 1999, 7.0,
+                  120, 1)
+    elapsed = time.time() - start
+    print "update: %.3fms per title" % (elapsed / lookups * 1000)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+""" Benchmark harness for kinoknecht.
+
+Generates a synthetic library, scans it with video probing stubbed out
+(so it runs offline and measures kinoknecht rather than ffmpeg) and times
+the scanner, the model methods, the web frontend and the API endpoints.
+Results are written as JSON, pass --compare with an earlier result file to
+see regressions.
+
+Usage: python benchmarks/harness.py [--files N] [--output FILE]
+                                    [--compare FILE] [--keep DIR]
+"""
+from __future__ import absolute_import
+
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from optparse import OptionParser
+
+import synthlib
+
+
+class FakeVideoStream(object):
+    """ Stand-in for ffvideo.VideoStream returning fixed specs """
+    duration = 5400.0
+    width = 704
+    height = 320
+    framerate = 25.0
+    codec_name = 'mpeg4'
+
+    def __init__(self, path):
+        pass
+
+
+def timeit(func, repeat=3):
+    runs = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        runs.append(time.time() - start)
+    return dict(min=min(runs), mean=sum(runs) / len(runs), runs=len(runs))
+
+
+def get_version():
+    try:
+        import pkg_resources
+        return pkg_resources.get_distribution('kinoknecht').version
+    except Exception:
+        return 'unknown'
+
+
+def run(options):
+    libdir = options.keep or tempfile.mkdtemp(prefix='kinoknecht-bench-')
+    if not os.path.exists(os.path.join(libdir, 'Movies')):
+        print "Generating %d files in %s" % (options.files, libdir)
+        start = time.time()
+        stats = synthlib.generate_library(libdir, options.files)
+        print "Generated %(videos)d videos, %(subtitles)d subtitles" % stats,
+        print "in %.1fs" % (time.time() - start)
+
+    # The configuration has to be in place before the database and the
+    # models are set up
+    from kinoknecht import config
+    config.video_dirs = [libdir]
+    config.db_address = options.db
+    # Per-file log messages would dominate the scan timings
+    logging.getLogger('kinoknecht').setLevel(logging.WARNING)
+
+    import kinoknecht.models
+    kinoknecht.models.VideoStream = FakeVideoStream
+    from kinoknecht.models import Videofile
+    from kinoknecht.database import init_db, shutdown_db
+    from kinoknecht.kinoweb import kinowebapp
+    from kinoknecht.cache import response_cache
+    from kinoknecht.api import DBApi
+    from simpleapi import DummyClient, Route
+
+    init_db()
+    results = {}
+    results['update_all'] = timeit(Videofile.update_all, repeat=1)
+    # Peak memory of the process, which is dominated by the initial scan
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results['rescan'] = timeit(Videofile.update_all)
+    results['statistics'] = timeit(Videofile.statistics)
+    results['search'] = timeit(lambda: Videofile.search(
+        Videofile.name.like('%spam%')).count())
+
+    web = kinowebapp.test_client()
+    pages = [1, 2, 10, max(1, options.files // 50)]
+
+    def browse_cold():
+        for page in pages:
+            response_cache.bump()
+            web.get('/browse/file/%d' % page)
+
+    def browse_warm():
+        for page in pages:
+            web.get('/browse/file/%d' % page)
+    results['browse_cold'] = timeit(browse_cold)
+    results['browse_warm'] = timeit(browse_warm)
+    results['web_search'] = timeit(lambda: web.get('/search/file/spam'))
+
+    client = DummyClient(Route(DBApi, framework='dummy'))
+    results['api_query'] = timeit(lambda: client.query(
+        category='file', searchstr='spam'))
+    results['api_details'] = timeit(lambda: [
+        client.details(category='file', id=i) for i in range(1, 101)])
+    results['api_get_clean_name'] = timeit(lambda: [
+        client.get_clean_name(vfid=i) for i in range(1, 101)])
+    shutdown_db()
+
+    if not options.keep:
+        shutil.rmtree(libdir)
+    return dict(version=get_version(), date=datetime.now().isoformat(),
+                python=platform.python_version(), files=options.files,
+                max_rss_kb=max_rss, results=results)
+
+
+def compare(old, new):
+    print "%-20s %10s %10s %8s" % ('benchmark', 'old', 'new', 'change')
+    for name in sorted(new['results']):
+        newtime = new['results'][name]['min']
+        if name not in old['results']:
+            print "%-20s %10s %9.4fs" % (name, '-', newtime)
+            continue
+        oldtime = old['results'][name]['min']
+        change = (newtime - oldtime) / oldtime * 100 if oldtime else 0
+        print "%-20s %9.4fs %9.4fs %+7.1f%%" % (name, oldtime, newtime,
+                                                 change)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--files', type='int', default=1000,
+                      help="Number of files in the synthetic library")
+    parser.add_option('--db', default='sqlite:///:memory:',
+                      help="Database to benchmark against")
+    parser.add_option('--output', default='benchmark.json',
+                      help="File to write the results to")
+    parser.add_option('--compare', help="Earlier result file to compare to")
+    parser.add_option('--keep', help="Generate the library in (or reuse "
+                                     "it from) this directory")
+    (options, args) = parser.parse_args()
+
+    result = run(options)
+    with open(options.output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print "Peak memory after the scan: %d KB" % result['max_rss_kb']
+    if options.compare:
+        with open(options.compare) as f:
+            compare(json.load(f), result)
+    else:
+        for name in sorted(result['results']):
+            print "%-20s %9.4fs" % (name, result['results'][name]['min'])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
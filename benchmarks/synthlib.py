@@ -0,0 +1,104 @@
+""" Generator for synthetic video libraries.
+
+All video files are sparse, so even a library with a million 700MB files
+only takes up a few GB on disk. Every file starts with a unique header to
+keep the hashes apart.
+"""
+from __future__ import absolute_import
+
+import os
+import random
+
+MOVIE_WORDS = ['Spam', 'Eggs', 'Meaning', 'Life', 'Holy', 'Grail', 'Brian',
+               'Matrix', 'Thief', 'Shinjuku', 'Diary', 'Night', 'Day',
+               'Return', 'Revenge', 'Last', 'First', 'Dark', 'City', 'Blue',
+               'Godard', 'Bande', 'Part', 'Opfergang', 'Stalker', 'Mirror']
+SHOW_WORDS = ['How', 'I', 'Met', 'Your', 'Mother', 'Skins', 'Seinfeld',
+              'Walking', 'Dead', 'Flying', 'Circus', 'Office', 'Wire']
+RELEASE_TAGS = ['DVDRip.XviD-KG', 'BDRip.x264-SPAM', 'DVDRip.DivX-EGGS',
+                'HDTV.XviD-LOL', '720p.BluRay.x264-HAM']
+EXTENSIONS = ['.avi', '.mkv', '.mpg', '.wmv']
+SUB_LANGS = ['', '.en', '.de', '.fr']
+
+FILES_PER_DIR = 500
+MOVIE_SIZE = 700 * 1024 * 1024
+EPISODE_SIZE = 350 * 1024 * 1024
+
+
+def _title(rng, words, length):
+    return ' '.join(rng.choice(words) for _ in range(length))
+
+
+def movie_name(rng, idx):
+    title = _title(rng, MOVIE_WORDS, rng.randint(1, 4))
+    year = rng.randint(1920, 2011)
+    style = idx % 3
+    if style == 0:
+        name = '%s.%d.%s' % (title.replace(' ', '.'), year,
+                             rng.choice(RELEASE_TAGS))
+    elif style == 1:
+        name = '%s (%d)' % (title, year)
+    else:
+        name = '%d - %s' % (year, title)
+    # Make the name unique, as the scanner identifies files by name and size
+    return '%s %d%s' % (name, idx, rng.choice(EXTENSIONS))
+
+
+def _write_sparse(path, size, idx):
+    with open(path, 'wb') as f:
+        f.write('kinoknecht-synthlib-%d\n' % idx)
+        f.truncate(size)
+
+
+def generate_library(root, count, show_ratio=0.4, subtitle_ratio=0.3,
+                     seed=0):
+    """ Creates a library of count sparse video files below root.
+
+    A share of show_ratio files are episodes in 'Show.Name.SXX' folders,
+    the rest are movies spread over directories of FILES_PER_DIR files.
+    subtitle_ratio of all files get a subtitle sibling. Returns a
+    dictionary with the number of created videos, subtitles and
+    directories.
+    """
+    rng = random.Random(seed)
+    stats = dict(videos=0, subtitles=0, directories=0)
+
+    def add_file(directory, fname, size):
+        _write_sparse(os.path.join(directory, fname), size, stats['videos'])
+        stats['videos'] += 1
+        if rng.random() < subtitle_ratio:
+            base = os.path.splitext(fname)[0]
+            subname = base + rng.choice(SUB_LANGS) + '.srt'
+            open(os.path.join(directory, subname), 'w').close()
+            stats['subtitles'] += 1
+
+    def make_dir(*parts):
+        directory = os.path.join(root, *parts)
+        os.makedirs(directory)
+        stats['directories'] += 1
+        return directory
+
+    num_episodes = int(count * show_ratio)
+    num_movies = count - num_episodes
+
+    show_idx = 0
+    while stats['videos'] < num_episodes:
+        show = '%s %d' % (_title(rng, SHOW_WORDS, rng.randint(1, 4)),
+                          show_idx)
+        show_idx += 1
+        for season in range(1, rng.randint(2, 8)):
+            dotted = show.replace(' ', '.')
+            directory = make_dir('Shows', show, '%s.S%02d' % (dotted, season))
+            for episode in range(1, rng.randint(10, 25)):
+                if stats['videos'] >= num_episodes:
+                    break
+                add_file(directory, '%s.S%02dE%02d%s' % (
+                    dotted, season, episode, rng.choice(EXTENSIONS)),
+                    EPISODE_SIZE)
+
+    directory = None
+    for idx in range(num_movies):
+        if idx % FILES_PER_DIR == 0:
+            directory = make_dir('Movies', '%04d' % (idx // FILES_PER_DIR))
+        add_file(directory, movie_name(rng, idx), MOVIE_SIZE)
+    return stats
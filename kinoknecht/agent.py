@@ -0,0 +1,245 @@
+from __future__ import absolute_import
+
+import logging
+import os
+import threading
+import time
+import urllib
+from wsgiref.simple_server import make_server
+
+from kinoknecht import availability, config
+from kinoknecht.metrics import SCAN_PHASE_SECONDS, SCANNED_FILES
+from kinoknecht.models import (Videofile, PROBED_FIELDS, _index_subtitles,
+                               _timed)
+from kinoknecht.server import ThreadedWSGIServer, QuietRequestHandler
+
+logger = logging.getLogger("kinoknecht.agent")
+
+# Size of the chunks files are served in
+CHUNK_SIZE = 65536
+
+
+def _below_any(path, roots):
+    return any(path == root or path.startswith(root + os.sep)
+               for root in roots)
+
+
+class ScanAgent(object):
+    """ Scans the video directories of a storage node and reports the
+    changes to the central catalogue.
+
+    All file access (walking, hashing, probing) happens on the node itself,
+    only compact batches of new and removed files are sent to the central
+    server's DBApi (see DBApi.ingest_batch).
+    """
+
+    def __init__(self, client, node=None, paths=None, batch_size=None):
+        self.client = client
+        self.node = node or config.node_name
+        self.paths = paths or config.video_dirs
+        self.batch_size = batch_size or config.agent_batch_size
+
+    def known_files(self):
+        """ Returns a dictionary mapping (path, name) to the size of all
+        files the central catalogue knows on this node.
+        """
+        return dict(((path, name), size) for (path, name, size)
+                    in self.client.node_files(node=self.node))
+
+    def scan(self):
+        """ Scans all video directories once, returns a dictionary with the
+        number of added and removed files.
+        """
+        known = self.known_files()
+        seen = set()
+        added = []
+        # Roots whose missing files can be reported as removed
+        complete = []
+        counts = dict(added=0, removed=0)
+        for path in self.paths:
+            root = os.path.abspath(path)
+            if not os.path.isdir(root) or \
+                    not availability.monitor.probe_root(root):
+                # An unmounted disk looks just like one without any files
+                logger.warning(u"Skipping %s, it is not available" % root)
+                continue
+            found = False
+            for (viddir, vidfiles, subfiles) in _timed(
+                    Videofile._walk_videofiles(root), 'walk'):
+                found = True
+                viddir = os.path.abspath(viddir)
+                subindex = _index_subtitles(subfiles, len(vidfiles) == 1)
+                for vidfile in vidfiles:
+                    key = (viddir, vidfile)
+                    seen.add(key)
+                    try:
+                        size = os.path.getsize(os.path.join(viddir, vidfile))
+                        if known.get(key) == size:
+                            SCANNED_FILES.labels('existing').inc()
+                            continue
+                        added.append(self._describe(viddir, vidfile,
+                                                    subindex))
+                        SCANNED_FILES.labels('added').inc()
+                    except (IOError, OSError) as e:
+                        SCANNED_FILES.labels('failed').inc()
+                        logger.error(e)
+                        continue
+                    if len(added) >= self.batch_size:
+                        counts['added'] += self.push(added=added)
+                        added = []
+            if found:
+                complete.append(root)
+            else:
+                logger.warning(u"No videofiles found in %s, not reporting "
+                               u"any of its files as removed" % root)
+        if added:
+            counts['added'] += self.push(added=added)
+        # Files that changed in size are replaced by the additions above
+        removed = [list(key) for key in known if key not in seen
+                   and _below_any(key[0], complete)]
+        for idx in range(0, len(removed), self.batch_size):
+            counts['removed'] += self.push(
+                removed=removed[idx:idx + self.batch_size])
+        logger.info(u"Reported %(added)d new and %(removed)d removed files"
+                    % counts)
+        return counts
+
+    def _describe(self, viddir, vidfile, subindex):
+        # The Videofile is never added to a session, it's only used to
+        # examine the file
+        vfobj = Videofile(viddir, vidfile)
+        with SCAN_PHASE_SECONDS.labels('subtitle').time():
+            vfobj.find_subtitle(subindex)
+        change = vfobj.schema().dump(vfobj, 'name', 'path', *PROBED_FIELDS)
+        if change['creation_date']:
+            change['creation_date'] = change['creation_date'].isoformat()
+        change['subtitles'] = [[sub.path, sub.language]
+                               for sub in vfobj.subtitles]
+        return change
+
+    def push(self, added=(), removed=()):
+        """ Sends a batch of changes to the central server, returns the
+        number of changes it accepted.
+        """
+        with SCAN_PHASE_SECONDS.labels('commit').time():
+            result = self.client.ingest_batch(node=self.node,
+                                              added=list(added),
+                                              removed=list(removed))
+        if not isinstance(result, dict):
+            raise RuntimeError(u"Central server rejected changes: %s"
+                               % result)
+        return result['added'] + result['updated'] + result['removed']
+
+
+class FileServer(object):
+    """ WSGI application that serves the files below the video directories
+    of this node at /files/<absolute path>, with support for range requests
+    so players can seek.
+    """
+
+    def __init__(self, roots=None):
+        self.roots = [os.path.realpath(root)
+                      for root in roots or config.video_dirs]
+
+    def _resolve(self, urlpath):
+        if not urlpath.startswith('/files/'):
+            return None
+        path = os.path.realpath(urllib.unquote(urlpath[len('/files'):]))
+        if not any(path.startswith(root + os.sep) for root in self.roots):
+            return None
+        if not os.path.isfile(path):
+            return None
+        return path
+
+    def __call__(self, environ, start_response):
+        path = self._resolve(environ.get('PATH_INFO', ''))
+        if path is None:
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return ['Not found']
+        size = os.path.getsize(path)
+        try:
+            (start, end) = (_parse_range(environ.get('HTTP_RANGE'), size)
+                            or (0, size - 1))
+        except UnsatisfiableRange:
+            start_response('416 Requested Range Not Satisfiable',
+                           [('Content-Type', 'text/plain'),
+                            ('Content-Range', 'bytes */%d' % size)])
+            return ['Requested range not satisfiable']
+        status = '200 OK'
+        headers = [('Content-Type', 'application/octet-stream'),
+                   ('Accept-Ranges', 'bytes')]
+        if (start, end) != (0, size - 1):
+            status = '206 Partial Content'
+            headers.append(('Content-Range',
+                            'bytes %d-%d/%d' % (start, end, size)))
+        headers.append(('Content-Length', str(end - start + 1)))
+        start_response(status, headers)
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        return _iter_file(path, start, end - start + 1)
+
+
+class UnsatisfiableRange(Exception):
+    """ Raised for a Range header that doesn't overlap the file """
+
+
+def _parse_range(header, size):
+    """ Returns the (start, end) byte positions of a single range in a
+    Range header, or None if there's no (usable) range. Raises
+    UnsatisfiableRange if the range lies beyond the end of the file.
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    try:
+        (start, end) = header[len('bytes='):].split('-')
+        if not start:
+            # Suffix range: the last n bytes
+            length = int(end)
+            if length <= 0 or size == 0:
+                raise UnsatisfiableRange(header)
+            return (max(0, size - length), size - 1)
+        (start, end) = (int(start), int(end) if end else None)
+    except ValueError:
+        return None
+    if end is not None and start > end:
+        return None
+    if start >= size:
+        raise UnsatisfiableRange(header)
+    return (start, size - 1 if end is None else min(end, size - 1))
+
+
+def _iter_file(path, offset, length):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def run_agent(central_url=None, port=None):
+    """ Runs the scan agent of this node: serves its files and reports
+    changes to the central server every config.agent_scan_interval seconds.
+    """
+    from simpleapi import Client
+    central_url = (central_url or config.central_url).rstrip('/')
+    server = make_server(config.server_host,
+                         port if port is not None else config.agent_port,
+                         FileServer(), server_class=ThreadedWSGIServer,
+                         handler_class=QuietRequestHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    logger.info(u"Serving files of node '%s' on %s:%d"
+                % ((config.node_name,) + server.server_address))
+
+    agent = ScanAgent(Client(ns=central_url + '/api/db/'))
+    while True:
+        try:
+            agent.scan()
+        except Exception as e:
+            # The central server might just be restarting
+            logger.error(u"Scan failed: %s" % e)
+        time.sleep(config.agent_scan_interval)
@@ -1,23 +1,149 @@
 from __future__ import absolute_import
 
-import json
-import os
-import re
+from datetime import datetime
 
 from imdb import IMDb
+from sqlalchemy.exc import SQLAlchemyError
 from simpleapi import Namespace 
 
-from kinoknecht import config
+from kinoknecht import availability, config, history, similarity, workers
+from kinoknecht.cache import response_cache
 from kinoknecht.database import db_session
-from kinoknecht.models import Videofile, Movie, Show, Episode
+from kinoknecht.metrics import IMDB_REQUEST_SECONDS, PLAYER_COMMAND_SECONDS
+from kinoknecht.models import (Videofile, Movie, Show, Episode, Subtitle,
+                               PROBED_FIELDS, episodes_videofiles)
+from kinoknecht.nameparser import TitleIndex, parse_name, parse_names
 from kinoknecht.player import Player
+from kinoknecht.scheduler import scheduler
+from kinoknecht.serializers import dumps, parse_datetime
 
 CATEGORIES = {'file': Videofile, 'movie': Movie, 'show': Show,
               'episode': Episode, 'unassigned': Videofile}
 
+# Background jobs only run in the production server ('kinoknecht serve')
+NO_SCHEDULER = "Background jobs only run with 'kinoknecht serve'!"
+
 imdb = IMDb()
 player = Player(config.extra_args)
 
+# Title indexes per category, together with the library generation they
+# were built for
+_title_indexes = {}
+
+
+def _title_index(category):
+    """ Returns an up to date TitleIndex over the titles of category """
+    generation = response_cache.generation
+    (built, index) = _title_indexes.get(category, (None, None))
+    if built != generation:
+        schema = CATEGORIES[category].schema()
+        index = TitleIndex(schema.query('id', 'title'))
+        _title_indexes[category] = (generation, index)
+    return index
+
+def _node_videofiles(node, names):
+    """ Returns a dictionary mapping (path, name) to the Videofiles on node
+    with one of the given names.
+    """
+    names = list(set(names))
+    vfiles = {}
+    # SQLite doesn't allow more than 999 parameters per statement
+    for idx in range(0, len(names), 900):
+        vfiles.update(((vfile.path, vfile.name), vfile) for vfile in
+                      Videofile.search(Videofile.node == node,
+                                       Videofile.name.in_(names[idx:idx+900])))
+    return vfiles
+
+
+def _title_history(title):
+    info = title.get_infodict('videofile_id', 'plays', 'completed',
+                              'watched_seconds', 'last_position',
+                              'last_watched')
+    info['name'] = title.videofile.name
+    info['completion_rate'] = title.completion_rate
+    return info
+
+
+def _build_object(category, vfiles=None, imdbid=None, title=None):
+    """ Creates (but doesn't commit) a new object in the given category.
+        vfiles has to be a list of Videofile objects.
+    """
+    if category == 'movie':
+        obj = Movie(videofiles=vfiles or [])
+    elif category == 'show':
+        obj = Show()
+    elif category == 'episode':
+        if not vfiles:
+            raise ValueError("Episodes need at least one videofile!")
+        obj = Episode(vfiles[0])
+    else:
+        raise ValueError("Invalid category!")
+
+    try:
+        if title:
+            obj.title = title
+        if imdbid:
+            obj.imdb_id = int(imdbid)
+    except:
+        # Don't let the backrefs of the videofiles drag the broken object
+        # into the session on the next commit
+        if not isinstance(obj, Show):
+            del obj.videofiles[:]
+        if obj in db_session:
+            db_session.expunge(obj)
+        raise
+    return obj
+
+
+def _assign(target, members):
+    """ Assigns members (episodes for shows, videofiles otherwise) to
+        target.
+    """
+    if isinstance(target, Show):
+        collection = target.episodes
+    else:
+        collection = target.videofiles
+    for member in members:
+        if member not in collection:
+            collection.append(member)
+
+
+def _episode_owners(vfids):
+    """ Maps the ids among vfids of videofiles that already belong to an
+        episode to the id of that episode.
+    """
+    vfids = [int(x) for x in vfids]
+    if not vfids:
+        return {}
+    cols = episodes_videofiles.c
+    return dict(db_session.query(cols.videofile_id, cols.episode_id)
+                .filter(cols.videofile_id.in_(vfids)))
+
+
+def _commit():
+    """ Commits the session and returns None, or rolls it back and returns
+        an error message if that fails.
+    """
+    try:
+        db_session.commit()
+    except SQLAlchemyError as e:
+        db_session.rollback()
+        return "Could not save the changes: %s" % e
+
+
+def _job_info(info):
+    """ Makes the timestamps of a job dictionary JSON-serializable """
+    return dict((key, value.isoformat() if isinstance(value, datetime)
+                 else value) for (key, value) in info.items())
+
+
+def _fetch_covers(objs):
+    """ Schedules the download of the covers of objs """
+    urls = sorted(set(obj.cover_url for obj in objs if obj.cover_url))
+    if urls:
+        scheduler.enqueue('covers', {'urls': urls})
+
+
 class DBApi(Namespace):
     def create(self, category, vfiles=None, imdbid=None, title=None):
         """ Creates a new object in the given category, optionally assigning
@@ -28,123 +154,408 @@ class DBApi(Namespace):
         if category not in CATEGORIES:
             return "Invalid category!"
         if vfiles:
-            vfiles = [Videofile.get(int(x)) for x in vfiles]
-        if imdbid:
-            imdbid = int(imdbid)
+            found = Videofile.get_many(vfiles)
+            vfiles = [found[int(x)] for x in vfiles if int(x) in found]
 
-        obj = None
-        if category == 'movie':
-            obj = Movie(videofiles=vfiles)
-        elif category == 'show':
-            obj = Show()
-        elif category == 'episode':
-            obj = Episode(vfiles[0])
-
-        if obj.title:
-            obj.title = title
-        if obj.imdb_id:
-            obj.imdb_id = int(imdbid)
+        try:
+            obj = _build_object(category, vfiles, imdbid, title)
+        except ValueError as e:
+            return str(e)
 
         db_session.add(obj)
         db_session.commit()
+        response_cache.bump()
+        _fetch_covers([obj])
         return obj.id
     create.published = True
 
+    def create_many(self, items):
+        """ Creates several objects in one transaction. items is a list of
+            dictionaries with the arguments for create(). Returns a list
+            with either {'id': newid} or {'error': message} for every item.
+        """
+        vfiles = Videofile.get_many(vfid for item in items
+                                    for vfid in item.get('vfiles') or [])
+        # A videofile can only belong to one episode
+        owners = _episode_owners(vfiles)
+        results = []
+        objs = []
+        for item in items:
+            if not item.get('imdbid') and not item.get('title'):
+                results.append(dict(
+                    error="Please specifiy either a title or an imdb id!"))
+                continue
+            try:
+                itemfiles = [vfiles[int(x)] for x in item.get('vfiles') or []]
+            except KeyError as e:
+                results.append(dict(error="No videofile with id %s!" % e))
+                continue
+            episode = item.get('category') == 'episode' and itemfiles
+            if episode and itemfiles[0].id in owners:
+                results.append(dict(
+                    error="Videofile %d already belongs to an episode!"
+                          % itemfiles[0].id))
+                continue
+            try:
+                obj = _build_object(item.get('category'), itemfiles,
+                                    item.get('imdbid'), item.get('title'))
+            except Exception as e:
+                results.append(dict(error=str(e)))
+                continue
+            if episode:
+                owners[itemfiles[0].id] = None
+            db_session.add(obj)
+            objs.append((len(results), obj))
+            results.append(None)
+        error = _commit()
+        if error:
+            return error
+        for (idx, obj) in objs:
+            results[idx] = dict(id=obj.id)
+        if objs:
+            response_cache.bump()
+            _fetch_covers(obj for (idx, obj) in objs)
+        return results
+    create_many.published = True
+
+    def assign_many(self, category, assignments):
+        """ Assigns videofiles to movies or episodes, or episodes to shows,
+            in one transaction. assignments is a list of
+            [target id, [member ids]] pairs. Returns a list with either
+            {'id': targetid, 'assigned': count} or {'id': targetid,
+            'error': message} for every pair.
+        """
+        if category not in ('movie', 'episode', 'show'):
+            return "Invalid category!"
+        membertype = Episode if category == 'show' else Videofile
+        targets = CATEGORIES[category].get_many(x[0] for x in assignments)
+        members = membertype.get_many(mid for x in assignments
+                                      for mid in x[1])
+        owners = {}
+        if category == 'episode':
+            # A videofile can only belong to one episode
+            owners = _episode_owners(members)
+        results = []
+        for (targetid, memberids) in assignments:
+            target = targets.get(int(targetid))
+            missing = [x for x in memberids if int(x) not in members]
+            taken = [x for x in memberids
+                     if owners.get(int(x), int(targetid)) != int(targetid)]
+            if not target:
+                results.append(dict(id=targetid, error="No such %s!"
+                                                       % category))
+            elif missing:
+                results.append(dict(id=targetid,
+                                    error="Unknown ids: %s" % missing))
+            elif taken:
+                results.append(dict(id=targetid,
+                                    error="Already assigned to another "
+                                          "episode: %s" % taken))
+            else:
+                _assign(target, [members[int(x)] for x in memberids])
+                if category == 'episode':
+                    owners.update((int(x), target.id) for x in memberids)
+                results.append(dict(id=targetid, assigned=len(memberids)))
+        error = _commit()
+        if error:
+            return error
+        response_cache.bump()
+        return results
+    assign_many.published = True
+
+    def delete_many(self, category, ids):
+        """ Deletes several objects of a category in one transaction.
+            Returns a list with either {'id': id} or {'id': id,
+            'error': message} for every id.
+        """
+        if category not in CATEGORIES:
+            return "Invalid category!"
+        objs = CATEGORIES[category].get_many(ids)
+        results = []
+        for objid in ids:
+            obj = objs.get(int(objid))
+            if obj is None:
+                results.append(dict(id=objid, error="No such %s!" % category))
+            else:
+                db_session.delete(obj)
+                results.append(dict(id=objid))
+        error = _commit()
+        if error:
+            return error
+        response_cache.bump()
+        return results
+    delete_many.published = True
+
     def query(self, category, searchstr):
         """Simple query for objects by category and name"""
         try: objtype = CATEGORIES[category]
         except KeyError: return "Invalid category!"
-        results = [dict(id=entry.id, title=entry.title) for entry in
-                objtype.query.filter(objtype.title.like('%' + searchstr + '%'))]
-        return json.dumps(results)
+        schema = objtype.schema()
+        query = schema.query('id', 'title').filter(
+                    objtype.title.like('%' + searchstr + '%'))
+        return dumps(list(schema.iter_rows(query, 'id', 'title')))
     query.published = True
 
     def add_to_show(self, showid, episodes):
         """Adds one or more episodes to a show"""
-        showid = int(showid)
-        episodes = [Episode.get(int(x)) for x in episodes]
-        show = Show.get(showid)
-        for epi in episodes:
-            show.episodes.append(epi)
-        return True
+        result = self.assign_many('show', [[showid, episodes]])[0]
+        return 'error' not in result
     add_to_show.published = True
 
     def query_imdb(self, searchstr):
         """Queries IMDb and returns a list of results"""
+        with IMDB_REQUEST_SECONDS.labels('search_movie').time():
+            entries = workers.call('imdb', imdb.search_movie, searchstr)
         results = [dict(imdbid=entry.movieID,
             title=entry['long imdb canonical title'])
-            for entry in imdb.search_movie(searchstr)]
-        return json.dumps(results[0:9])
+            for entry in entries]
+        return dumps(results[0:9])
     query_imdb.published = True
 
     def details(self, category, id):
         """Returns a dictionary with details for a given record"""
-        infodict = CATEGORIES[category].get(id).get_infodict()
-        return json.dumps(infodict)
+        key = response_cache.key('api.details', category, id)
+        result = response_cache.get(key)
+        if result is None:
+            infodict = CATEGORIES[category].get(id).get_infodict()
+            result = dumps(infodict)
+            response_cache.set(key, result)
+        return result
+
+    def similar(self, category, id, limit=5):
+        """Returns [id, title, score] for the movies, episodes or shows most
+           similar to a given one
+        """
+        if category not in similarity.CATEGORIES:
+            return "Invalid category!"
+        index = similarity.get_index(category)
+        ranked = index.similar(int(id), int(limit))
+        titles = dict(CATEGORIES[category].schema().query('id', 'title')
+                      .filter(CATEGORIES[category].id.in_(
+                          [x[0] for x in ranked])))
+        return [[objid, titles.get(objid), score]
+                for (objid, score) in ranked]
+    similar.published = True
 
     def get_clean_name(self, fname=None, vfid=None):
-        #FIXME: There seems to be a nasty bug in simpleapi relating to
-        #       years in filenames. Try running the tests and see foryourself.
         """ Returns a cleaned up version of fname (or of fname of Videofile
             with vfid) to facilitate imdb queriyng.
         """
-        #TODO: Move this to a Videofile method?
         if not fname and not vfid:
             raise Exception(
                     'Insufficient arguments, specify either fname or vfid')
-        # For files that comply to scene filenaming "standards"
-        scene_rexp = re.compile(r'([\w\s]+)( \d{4})? (.+Rip) .*', re.I)
-        # That is one nasty sunnufabitch...
-        rexp = re.compile(r'(?:\d{4}\s*\-\s*?)?(?:[\w\s]*-\s*)?([\w\s\.\-]+)(?:\(?\d{4}\)?)?.*', re.I)
         if not fname:
             fname = Videofile.get(int(vfid)).name
-        # Normalize the name by removing the extension and all dots
-        fname = os.path.splitext(fname)[0].replace('.', ' ')
-        # Do we have a scene filename?
-        fname_match = scene_rexp.match(fname)
-        if fname_match:
-            return fname_match.groups()[0].strip()
-        # Doesn't look like it, let's be more fuzzy
-        fname_match = rexp.match(fname)
-        if fname_match:
-            return fname_match.groups()[0].strip()
-        # We give up and just return the normalized name
-        else:
-            return fname
+        return parse_name(fname).title
     get_clean_name.published = True
 
-    def update_database(self):
-        """Tells the database to update all its directories"""
+    def match_titles(self, category, vfids):
+        """ Suggests existing movies or shows for several videofiles at
+            once, based on their cleaned up names. Returns a list with
+            a list of [id, title, score] suggestions for every videofile.
+        """
+        if category not in ('movie', 'show'):
+            return "Invalid category!"
+        index = _title_index(category)
+        names = dict(Videofile.schema().query('id', 'name').filter(
+                         Videofile.id.in_([int(x) for x in vfids])))
+        # Files matched to shows are episodes
+        parsed = parse_names([names.get(int(x), u'') for x in vfids],
+                             is_episode=(category == 'show'))
+        return [[list(m) for m in index.match(p.title)] for p in parsed]
+    match_titles.published = True
+
+    def node_files(self, node):
+        """Returns [path, name, size] for all videofiles on a storage node"""
+        schema = Videofile.schema()
+        query = schema.query('path', 'name', 'size').filter(
+                    Videofile.node == node)
+        return [list(row) for row in query]
+    node_files.published = True
+
+    def ingest_batch(self, node, added=None, removed=None):
+        """ Applies a batch of changes reported by the scan agent of a
+            storage node in one transaction. added is a list of dictionaries
+            with the name, path, specs and subtitles ([path, language]
+            pairs) of new or changed videofiles, removed a list of
+            [path, name] pairs. Returns a dictionary with the number of
+            added, updated and removed videofiles.
+        """
+        if node not in config.nodes:
+            return "Unknown node!"
+        added = added or []
+        removed = removed or []
+        existing = _node_videofiles(node, [x['name'] for x in added] +
+                                          [x[1] for x in removed])
+        counts = dict(added=0, updated=0, removed=0)
+        for change in added:
+            specs = dict((str(k), v) for (k, v) in change.items()
+                         if k in PROBED_FIELDS)
+            specs['creation_date'] = parse_datetime(
+                specs.get('creation_date'))
+            vfile = existing.get((change['path'], change['name']))
+            if vfile is None:
+                vfile = Videofile(change['path'], change['name'], node,
+                                  **specs)
+                db_session.add(vfile)
+                counts['added'] += 1
+            else:
+                for (field, value) in specs.items():
+                    setattr(vfile, field, value)
+                counts['updated'] += 1
+            known = set(sub.path for sub in vfile.subtitles)
+            for (subpath, language) in change.get('subtitles') or []:
+                if subpath not in known:
+                    vfile.add_subtitle(subpath, language)
+        for (path, name) in removed:
+            vfile = existing.get((path, name))
+            if vfile is not None:
+                db_session.delete(vfile)
+                counts['removed'] += 1
+        db_session.commit()
+        if any(counts.values()):
+            response_cache.bump()
+        return counts
+    ingest_batch.published = True
+
+    def recently_watched(self, limit=10):
+        """Returns the playback statistics of the last watched videofiles"""
+        return dumps([_title_history(x) for x in
+                      history.recently_watched(int(limit))])
+    recently_watched.published = True
+
+    def continue_watching(self, limit=10):
+        """Returns the videofiles that were stopped before their end, with
+           the position to resume from
+        """
+        return dumps([_title_history(x) for x in
+                      history.continue_watching(int(limit))])
+    continue_watching.published = True
+
+    def watch_statistics(self, days=30):
+        """Returns the playback statistics of the last days"""
+        return dumps([dict(x.get_infodict('day', 'plays', 'completed',
+                                          'watched_seconds'),
+                           completion_rate=x.completion_rate)
+                      for x in history.daily_statistics(int(days))])
+    watch_statistics.published = True
+
+    def storage_status(self):
+        """Returns the last known state of the video directories and the
+           storage nodes
+        """
+        return dumps(availability.monitor.status())
+    storage_status.published = True
+
+    def update_database(self, background=False):
+        """Tells the database to update all its directories. If background
+           is set, a scan job is scheduled and its id is returned, see
+           job_status.
+        """
+        if background:
+            if not scheduler.running:
+                return NO_SCHEDULER
+            return scheduler.enqueue('scan', priority=10)
         Videofile.update_all()
         return True
     update_database.published = True
 
+    def schedule_job(self, jobtype, params=None, priority=0, delay=0,
+                     offpeak=False):
+        """Schedules a background job (one of 'scan', 'metadata',
+           'enrich_show' and 'covers') and returns its id. If offpeak is
+           set, the job waits for the off-peak hours.
+        """
+        if not scheduler.running:
+            return NO_SCHEDULER
+        try:
+            return scheduler.enqueue(jobtype, params, int(priority),
+                                     int(delay), offpeak=bool(offpeak))
+        except ValueError as e:
+            return str(e)
+    schedule_job.published = True
+
+    def job_status(self, jobid=None):
+        """Returns the status and progress of a background job, or of all
+           queued and running jobs if no jobid is specified.
+        """
+        if jobid is None:
+            return [_job_info(x) for x in scheduler.jobs('queued', 'running')]
+        status = scheduler.status(int(jobid))
+        if not status:
+            return "No such job!"
+        return _job_info(status)
+    job_status.published = True
+
+    def cancel_job(self, jobid):
+        """Cancels a queued or running background job"""
+        return scheduler.cancel(int(jobid))
+    cancel_job.published = True
+
+def _player_position():
+    with PLAYER_COMMAND_SECONDS.labels('time_pos').time():
+        return player.time_pos
+
+
 class PlayerApi(Namespace):
-    def play(self, category, id):
+    def play(self, category, id, resume=False):
+        """Plays a videofile, from the position it was last stopped at if
+           resume is set
+        """
         vfile = Videofile.get(id)
-        player.loadfile(os.path.join(vfile.path, vfile.name))
+        if not vfile.available:
+            return "The storage of this file is offline!"
+        with PLAYER_COMMAND_SECONDS.labels('loadfile').time():
+            player.loadfile(vfile.location())
+        position = 0
+        if resume and vfile.last_pos:
+            position = vfile.last_pos
+            with PLAYER_COMMAND_SECONDS.labels('seek').time():
+                # Absolute seek
+                player.seek(position, 2)
+        history.record('play', vfile.id, position, vfile.length)
         return True
     play.published = True
 
     def pause(self):
-        player.pause()
+        position = _player_position()
+        with PLAYER_COMMAND_SECONDS.labels('pause').time():
+            player.pause()
+        history.record('pause', position=position)
         return True
     pause.published = True
 
     def stop(self):
-        player.stop()
+        position = _player_position()
+        with PLAYER_COMMAND_SECONDS.labels('stop').time():
+            player.stop()
+        history.record('stop', position=position)
         return True
     stop.published = True
 
     def seek(self, position):
-        player.seek(position)
+        with PLAYER_COMMAND_SECONDS.labels('seek').time():
+            player.seek(position)
+        history.record('seek', position=_player_position())
         return True
     seek.published = True
 
+    def list_subtitles(self, id):
+        """Returns the subtitles available for a videofile"""
+        schema = Subtitle.schema()
+        query = schema.query('id', 'language', 'path').filter(
+                    Subtitle.videofile_id == int(id))
+        return list(schema.iter_rows(query, 'id', 'language', 'path'))
+    list_subtitles.published = True
+
     def load_subtitle(self, subid):
-        subpath = os.path.abspath(Videofile.subfilepaths[subid])
-        player.sub_load(subpath)
+        subtitle = Subtitle.get(int(subid))
+        if not subtitle:
+            return False
+        with PLAYER_COMMAND_SECONDS.labels('sub_load').time():
+            player.sub_load(subtitle.location())
+        return True
+    load_subtitle.published = True
 
     def get_position(self):
-        return player.time_pos
-
+        return _player_position()
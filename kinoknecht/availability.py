@@ -0,0 +1,154 @@
+from __future__ import absolute_import
+
+import logging
+import os
+import threading
+import urllib2
+from datetime import datetime
+
+from kinoknecht import config
+
+logger = logging.getLogger("kinoknecht.availability")
+
+
+def root_for(path):
+    """ Returns the configured video directory containing path, or None """
+    path = os.path.abspath(path)
+    for root in sorted((os.path.abspath(d) for d in config.video_dirs),
+                       key=len, reverse=True):
+        if path == root or path.startswith(root + os.sep):
+            return root
+    return None
+
+
+def node_key(node):
+    return u'node:%s' % node
+
+
+class AvailabilityMap(object):
+    """ Cached online/offline state of the video directories of this node
+    and of the other storage nodes.
+
+    The state is only ever changed by probes, which run in their own
+    threads and count as failed if they don't finish within timeout
+    seconds, so a sleeping disk or a hanging NFS mount can't block the
+    caller. Everything that hasn't been probed yet counts as online.
+    """
+
+    def __init__(self, timeout=5):
+        self.timeout = timeout
+        # Increased on every change, to invalidate pages showing the state
+        self.version = 0
+        self._status = {}
+        self._probing = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def is_online(self, key):
+        status = self._status.get(key)
+        return status is None or status['online']
+
+    def status(self):
+        """ Returns a dictionary with the state of every probed key """
+        with self._lock:
+            return dict((key, dict(status))
+                        for (key, status) in self._status.items())
+
+    def _set(self, key, online, error=None):
+        with self._lock:
+            was_online = self.is_online(key)
+            self._status[key] = dict(online=online, error=error,
+                                     checked=datetime.now())
+            if online != was_online:
+                self.version += 1
+        if online and not was_online:
+            logger.info(u"%s is back online" % key)
+        elif was_online and not online:
+            logger.warning(u"%s is offline: %s" % (key, error))
+
+    def probe(self, key, check):
+        """ Runs check() with a timeout and records whether key is online,
+        which is returned. An exception from check() means offline.
+        """
+        with self._lock:
+            hanging = key in self._probing
+            self._probing.add(key)
+        if hanging:
+            # The last probe still hangs, don't pile up threads
+            self._set(key, False, u"Probe still running")
+            return False
+
+        def run():
+            try:
+                check()
+                self._set(key, True)
+            except Exception as e:
+                self._set(key, False, unicode(e))
+            finally:
+                with self._lock:
+                    self._probing.discard(key)
+        thread = threading.Thread(target=run, name='kinoknecht-probe')
+        thread.daemon = True
+        thread.start()
+        thread.join(self.timeout)
+        if thread.is_alive():
+            # The thread records the real state once it returns
+            self._set(key, False, u"No answer within %gs" % self.timeout)
+            return False
+        return self.is_online(key)
+
+    def probe_root(self, root):
+        return self.probe(root, lambda: os.listdir(root))
+
+    def probe_node(self, node):
+        def check():
+            try:
+                urllib2.urlopen(config.nodes[node],
+                                timeout=self.timeout).close()
+            except urllib2.HTTPError:
+                # The scan agent answered, even if not with a page
+                pass
+        return self.probe(node_key(node), check)
+
+    def probe_all(self):
+        for root in config.video_dirs:
+            self.probe_root(os.path.abspath(root))
+        for node in config.nodes:
+            self.probe_node(node)
+
+    def start(self, interval):
+        """ Probes everything every interval seconds in the background """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.is_set():
+                self.probe_all()
+                self._stop.wait(interval)
+        self._thread = threading.Thread(target=loop,
+                                        name='kinoknecht-availability')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+
+
+monitor = AvailabilityMap(config.storage_probe_timeout)
+
+
+def path_available(path):
+    """ Tells whether path is (as far as known) accessible, without
+    touching the filesystem.
+    """
+    root = root_for(path)
+    return root is None or monitor.is_online(root)
+
+
+def node_available(node):
+    return monitor.is_online(node_key(node))
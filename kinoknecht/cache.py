@@ -0,0 +1,131 @@
+from __future__ import absolute_import
+
+import logging
+import threading
+from collections import OrderedDict
+from hashlib import sha1
+
+from kinoknecht import config
+from kinoknecht.helpers import to_unicode
+
+logger = logging.getLogger("kinoknecht.cache")
+
+GENERATION_KEY = 'kinoknecht:generation'
+
+
+class LRUCache(object):
+    """ Thread-safe in-process cache that evicts the least recently used
+    entry once maxsize is reached.
+    """
+    shared = False
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return None
+            # Re-insert to mark the entry as most recently used
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class MemcachedCache(object):
+    """ Cache backed by a (local) memcached-compatible server, shared by all
+    processes serving the same library.
+    """
+    shared = True
+
+    def __init__(self, servers):
+        import memcache
+        self._client = memcache.Client(servers)
+
+    def get(self, key):
+        return self._client.get(key)
+
+    def set(self, key, value):
+        self._client.set(key, value)
+
+    def incr(self, key):
+        # incr() fails on missing keys, so make sure there is one
+        self._client.add(key, 0)
+        return self._client.incr(key)
+
+    def clear(self):
+        # Stale entries are never hit again once the generation changes,
+        # memcached will evict them on its own.
+        pass
+
+
+class ResponseCache(object):
+    """ Cache for rendered pages and API payloads.
+
+    Every key carries the current library generation, which is bumped
+    whenever the library changes (scans, edits). Bumping the generation
+    thus invalidates all cached entries at once.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self):
+        if self.backend.shared:
+            return int(self.backend.get(GENERATION_KEY) or 0)
+        return self._generation
+
+    def bump(self):
+        """ Signal that the library has changed. """
+        if self.backend.shared:
+            self.backend.incr(GENERATION_KEY)
+        else:
+            with self._lock:
+                self._generation += 1
+        self.backend.clear()
+        logger.debug(u"Library generation is now %d" % self.generation)
+
+    def key(self, *parts):
+        """ Returns the cache key for parts, which doubles as ETag. """
+        rawkey = u':'.join([unicode(self.generation)] +
+                           [to_unicode(x) for x in parts])
+        return sha1(rawkey.encode('UTF-8')).hexdigest()
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, value):
+        self.backend.set(key, value)
+
+
+def create_backend():
+    if config.cache_backend == 'memcached':
+        try:
+            return MemcachedCache(config.memcached_servers)
+        except ImportError:
+            logger.warning(u"python-memcached is not installed, falling back "
+                           u"to in-process cache")
+    return LRUCache(config.cache_size)
+
+
+response_cache = ResponseCache(create_backend())
@@ -0,0 +1,132 @@
+from __future__ import absolute_import
+
+import gzip
+import logging
+
+from sqlalchemy import Date, DateTime
+
+from kinoknecht.cache import response_cache
+from kinoknecht.database import Base, engine
+from kinoknecht.serializers import dumps, json, parse_date, parse_datetime
+
+logger = logging.getLogger("kinoknecht.catalogue")
+
+FORMAT_NAME = 'kinoknecht-catalogue'
+FORMAT_VERSION = 1
+CHUNK_SIZE = 5000
+# Tables that don't belong to the catalogue proper
+SKIP_TABLES = ('jobs', 'scan_checkpoints', 'cover_images')
+
+
+def export_catalogue(fileobj):
+    """ Writes all tables of the catalogue to fileobj.
+
+    The format is newline-delimited JSON: a header line, then for every
+    table a line with its name and column names, followed by one JSON
+    array per row. Tables are written in dependency order, so they can be
+    imported in the same order. Returns the number of exported rows.
+    """
+    fileobj.write(dumps({'format': FORMAT_NAME,
+                         'version': FORMAT_VERSION}) + '\n')
+    total = 0
+    conn = engine.connect().execution_options(stream_results=True)
+    try:
+        for table in Base.metadata.sorted_tables:
+            if table.name in SKIP_TABLES:
+                continue
+            columns = [c.name for c in table.columns]
+            fileobj.write(dumps({'table': table.name,
+                                 'columns': columns}) + '\n')
+            for row in conn.execute(table.select()):
+                fileobj.write(dumps(list(row)) + '\n')
+                total += 1
+    finally:
+        conn.close()
+    logger.info(u"Exported %d rows" % total)
+    return total
+
+
+def import_catalogue(fileobj, replace=True, chunk_size=CHUNK_SIZE):
+    """ Reads a catalogue written by export_catalogue from fileobj.
+
+    Rows are inserted in batches of chunk_size, all in one transaction.
+    If replace is set, existing entries are deleted first. Rows keep their
+    primary keys, so without replace the catalogue can only be imported
+    into an empty database, a ValueError is raised otherwise. Returns the
+    number of imported rows.
+    """
+    header = json.loads(fileobj.readline())
+    if header.get('format') != FORMAT_NAME:
+        raise ValueError("Not a kinoknecht catalogue!")
+    if header.get('version') != FORMAT_VERSION:
+        raise ValueError("Unsupported catalogue version %r"
+                         % header.get('version'))
+
+    tables = Base.metadata.tables
+    total = 0
+    conn = engine.connect()
+    trans = conn.begin()
+    try:
+        for table in reversed(Base.metadata.sorted_tables):
+            if table.name in SKIP_TABLES:
+                continue
+            if replace:
+                conn.execute(table.delete())
+            elif conn.execute(table.select().limit(1)).first() is not None:
+                raise ValueError("Cannot merge a catalogue into a non-empty "
+                                 "database, the ids would collide!")
+        table = columns = None
+        batch = []
+        for line in fileobj:
+            entry = json.loads(line)
+            if isinstance(entry, dict):
+                if batch:
+                    conn.execute(table.insert(), batch)
+                    batch = []
+                table = tables[entry['table']]
+                columns = entry['columns']
+                # Dates are exported as ISO strings
+                parsers = {}
+                for col in columns:
+                    if isinstance(table.c[col].type, DateTime):
+                        parsers[col] = parse_datetime
+                    elif isinstance(table.c[col].type, Date):
+                        parsers[col] = parse_date
+                continue
+            row = dict(zip(columns, entry))
+            for (col, parse) in parsers.items():
+                row[col] = parse(row[col])
+            batch.append(row)
+            total += 1
+            if len(batch) >= chunk_size:
+                conn.execute(table.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(table.insert(), batch)
+        trans.commit()
+    except:
+        trans.rollback()
+        raise
+    finally:
+        conn.close()
+    response_cache.bump()
+    logger.info(u"Imported %d rows" % total)
+    return total
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def export_file(path):
+    """ Exports the catalogue to path, gzip-compressed if it ends in .gz """
+    with _open(path, 'wb') as f:
+        return export_catalogue(f)
+
+
+def import_file(path, replace=True):
+    """ Imports the catalogue from path, see export_file """
+    with _open(path, 'rb') as f:
+        return import_catalogue(f, replace=replace)
@@ -3,6 +3,56 @@ db_address = "sqlite:///:memory:"
 log_file = "debug.log"
 log_level = "debug"
 video_dirs = ["tests/testdir"]
+# Number of new files to commit at once while scanning
+scan_chunk_size = 500
 
 # Player setup
 extra_args = "-vo fbdev2 -xy 800 -zoom -fs -softvol"
+
+# Response cache setup ("lru" or "memcached")
+cache_backend = "lru"
+cache_size = 512
+memcached_servers = ["127.0.0.1:11211"]
+
+# Server setup, number of threads per worker pool
+server_host = "0.0.0.0"
+server_port = 5000
+worker_pools = {"db": 4, "imdb": 2}
+# Maximum number of concurrently streamed exports (/stream)
+max_streams = 2
+
+# Background jobs: maximum number of concurrently running jobs, the
+# off-peak hours (start, end) and jobs to repeat every n seconds
+scheduler_workers = 2
+offpeak_hours = (1, 6)
+recurring_jobs = [("scan", 86400), ("covers", 86400)]
+
+# Storage nodes: the name of this node and the base URLs of the scan
+# agents running on the other nodes, which also serve their files
+node_name = "local"
+nodes = {}
+
+# Scan agent mode: the central server to report to, the port to serve
+# files on, the number of files per change batch and the scan interval
+central_url = "http://127.0.0.1:5000"
+agent_port = 5001
+agent_batch_size = 100
+agent_scan_interval = 3600
+
+# Playback history: number of buffered events that trigger a write, and
+# the maximum number of seconds events are buffered
+history_batch_size = 50
+history_flush_interval = 5
+
+# Storage availability: seconds between probes of the video directories
+# and storage nodes, and seconds after which a probe counts as failed
+storage_probe_interval = 60
+storage_probe_timeout = 5
+
+# Cover image cache: the directory to store the covers in, the bounding
+# boxes (width, height) of the stored sizes, the WebP/JPEG quality and
+# seconds after which a download is given up
+image_dir = "images"
+image_sizes = {"thumb": (92, 136), "poster": (300, 444)}
+image_quality = 80
+image_fetch_timeout = 30
@@ -5,10 +5,11 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
-from kinoknecht import config
+from kinoknecht import config, metrics
 
 logger = logging.getLogger("kinoknecht.database")
 engine = create_engine(config.db_address, convert_unicode=True)
+metrics.instrument_engine(engine)
 db_session = scoped_session(sessionmaker(bind=engine))
 Base = declarative_base()
 Base.query = db_session.query_property()
@@ -19,6 +20,9 @@ def init_db():
         db_session = scoped_session(sessionmaker(bind=engine))
 
     import kinoknecht.models
+    import kinoknecht.history
+    import kinoknecht.images
+    import kinoknecht.scheduler
     Base.metadata.create_all(bind=engine)
     logger.debug('Database successfully set up!')
 
@@ -0,0 +1,337 @@
+from __future__ import absolute_import
+
+import logging
+import threading
+import traceback
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import (Column, Boolean, Date, DateTime, Float, ForeignKey,
+                        Index, Integer, String)
+from sqlalchemy.orm import joinedload, relationship
+
+from kinoknecht import config
+from kinoknecht.cache import response_cache
+from kinoknecht.database import Base, db_session
+from kinoknecht.models import KinoBase, Videofile
+
+logger = logging.getLogger("kinoknecht.history")
+
+# Fraction of a videofile that has to be watched for it to count as
+# completed
+COMPLETION_THRESHOLD = 0.9
+# Limits for keeping changes around while the database can't be written:
+# the number of buffered events and the number of failed writes after
+# which everything is dropped
+MAX_BUFFERED_EVENTS = 5000
+MAX_FAILED_FLUSHES = 10
+
+
+class PlaybackEvent(Base, KinoBase):
+    """ A single player command, the log is append-only """
+    __tablename__ = 'playback_events'
+    __table_args__ = (
+        Index('ix_playback_events_timestamp', 'timestamp'),
+        {}
+    )
+
+    videofile_id = Column(Integer, ForeignKey('videofiles.id'), index=True)
+    # One of 'play', 'pause', 'resume', 'seek' and 'stop'
+    event = Column(String)
+    position = Column(Float, nullable=True)
+    timestamp = Column(DateTime)
+
+    def __repr__(self):
+        return "<PlaybackEvent('%s', '%s')>" % (self.event, self.timestamp)
+
+
+class TitleHistory(Base, KinoBase):
+    """ Playback statistics of a videofile, kept up to date by the
+    HistoryWriter.
+    """
+    __tablename__ = 'playback_titles'
+    __table_args__ = (
+        # For the 'recently watched' and 'continue watching' views
+        Index('ix_playback_titles_last_watched', 'last_watched'),
+        Index('ix_playback_titles_finished_last_watched', 'finished',
+              'last_watched'),
+        {}
+    )
+
+    videofile_id = Column(Integer, ForeignKey('videofiles.id'), unique=True)
+    videofile = relationship('Videofile')
+    plays = Column(Integer, default=0)
+    completed = Column(Integer, default=0)
+    watched_seconds = Column(Float, default=0.0)
+    last_position = Column(Float, nullable=True)
+    last_watched = Column(DateTime)
+    finished = Column(Boolean, default=False)
+
+    @property
+    def completion_rate(self):
+        return float(self.completed) / self.plays if self.plays else 0.0
+
+
+class DailyHistory(Base, KinoBase):
+    """ Playback statistics of a single day """
+    __tablename__ = 'playback_days'
+
+    day = Column(Date, unique=True)
+    plays = Column(Integer, default=0)
+    completed = Column(Integer, default=0)
+    watched_seconds = Column(Float, default=0.0)
+
+    @property
+    def completion_rate(self):
+        return float(self.completed) / self.plays if self.plays else 0.0
+
+
+def _new_delta():
+    return dict(plays=0, completed=0, watched_seconds=0.0)
+
+
+class HistoryWriter(object):
+    """ Buffers playback events and the changes they make to the rollups,
+    and writes both in batches from a background thread, so player
+    commands never wait for the database.
+
+    There's only one player, so the writer keeps track of the videofile
+    that is currently playing and attributes all events to it.
+    """
+
+    def __init__(self, batch_size=50, flush_interval=5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._events = []
+        self._titles = {}
+        self._days = {}
+        self._current = None
+        self._failures = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop,
+                                            name='kinoknecht-history')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.error(u"Writing the playback history failed:\n%s"
+                             % traceback.format_exc())
+            finally:
+                db_session.remove()
+
+    def record(self, event, videofile_id=None, position=None, length=None,
+               timestamp=None):
+        """ Records a player command. 'play' needs the videofile_id (and
+        length) of the played file, all other events refer to it.
+        """
+        now = timestamp or datetime.now()
+        with self._lock:
+            if event == 'play':
+                if self._current is not None:
+                    # Loading a new file stops the old one
+                    self._stop(now, None)
+                self._current = dict(id=videofile_id, length=length,
+                                     since=now)
+                for delta in self._deltas(videofile_id, now):
+                    delta['plays'] += 1
+                self._deltas(videofile_id, now)[0]['position'] = position
+            elif self._current is None:
+                # Nothing is playing, so there's nothing to record
+                return
+            else:
+                videofile_id = self._current['id']
+                if event == 'pause' and self._current['since'] is None:
+                    # Pausing toggles, this continues playback
+                    event = 'resume'
+                    self._current['since'] = now
+                elif event == 'pause':
+                    self._account(now)
+                    self._current['since'] = None
+                    self._deltas(videofile_id, now)[0]['position'] = position
+                elif event == 'stop':
+                    self._stop(now, position)
+            self._events.append(dict(videofile_id=videofile_id, event=event,
+                                     position=position, timestamp=now))
+            full = len(self._events) >= self.batch_size
+        self._start()
+        if full:
+            self._wake.set()
+
+    def _deltas(self, videofile_id, now):
+        title = self._titles.setdefault(videofile_id, _new_delta())
+        title['last_watched'] = now
+        return (title, self._days.setdefault(now.date(), _new_delta()))
+
+    def _account(self, now):
+        """ Adds the time since playback (re)started to the watched time """
+        if self._current['since'] is not None:
+            seconds = (now - self._current['since']).total_seconds()
+            for delta in self._deltas(self._current['id'], now):
+                delta['watched_seconds'] += seconds
+
+    def _stop(self, now, position):
+        self._account(now)
+        (title, day) = self._deltas(self._current['id'], now)
+        length = self._current['length']
+        if position is not None and length and \
+                position >= length * COMPLETION_THRESHOLD:
+            title['completed'] += 1
+            day['completed'] += 1
+            title['finished'] = True
+            title['position'] = None
+        elif position is not None:
+            title['finished'] = False
+            title['position'] = position
+        self._current = None
+
+    def flush(self):
+        """ Writes the buffered events and rollup changes in a single
+        transaction. Returns the number of written events.
+        """
+        with self._flush_lock:
+            with self._lock:
+                (events, titles, days) = (self._events, self._titles,
+                                          self._days)
+                self._events, self._titles, self._days = [], {}, {}
+            if not events and not titles:
+                return 0
+            try:
+                if events:
+                    db_session.execute(PlaybackEvent.__table__.insert(),
+                                       events)
+                self._apply_titles(titles)
+                self._apply_days(days)
+                db_session.commit()
+            except:
+                db_session.rollback()
+                self._keep(events, titles, days)
+                raise
+            self._failures = 0
+            if titles:
+                # Play counts and positions show up on the cached pages
+                # and in the similarity index
+                response_cache.bump()
+        return len(events)
+
+    def _keep(self, events, titles, days):
+        """ Puts the changes of a failed flush back for the next attempt,
+        within the limits of MAX_BUFFERED_EVENTS and MAX_FAILED_FLUSHES.
+        """
+        self._failures += 1
+        if self._failures >= MAX_FAILED_FLUSHES:
+            logger.error(u"Dropping %d playback events and the statistics "
+                         u"of %d titles after %d failed writes"
+                         % (len(events), len(titles), self._failures))
+            self._failures = 0
+            return
+        with self._lock:
+            self._events[:0] = events
+            self._merge(titles, days)
+            excess = len(self._events) - MAX_BUFFERED_EVENTS
+            if excess > 0:
+                # The oldest events go first, the rollups stay complete
+                del self._events[:excess]
+        if excess > 0:
+            logger.warning(u"Dropped the %d oldest unwritten playback events"
+                           % excess)
+
+    def _merge(self, titles, days):
+        for (key, delta) in titles.items():
+            newer = self._titles.get(key)
+            if newer is not None:
+                for field in ('plays', 'completed', 'watched_seconds'):
+                    newer[field] += delta[field]
+                for field in ('position', 'finished'):
+                    if field in delta and field not in newer:
+                        newer[field] = delta[field]
+            else:
+                self._titles[key] = delta
+        for (key, delta) in days.items():
+            newer = self._days.setdefault(key, _new_delta())
+            for field in ('plays', 'completed', 'watched_seconds'):
+                newer[field] += delta[field]
+
+    def _apply_titles(self, titles):
+        existing = dict((x.videofile_id, x) for x in TitleHistory.search(
+            TitleHistory.videofile_id.in_(titles.keys())))
+        vfiles = Videofile.get_many(titles.keys())
+        for (vfid, delta) in titles.items():
+            title = existing.get(vfid)
+            if title is None:
+                title = TitleHistory(videofile_id=vfid, plays=0, completed=0,
+                                     watched_seconds=0.0, finished=False)
+                db_session.add(title)
+            title.plays += delta['plays']
+            title.completed += delta['completed']
+            title.watched_seconds += delta['watched_seconds']
+            title.last_watched = delta['last_watched']
+            if 'finished' in delta:
+                title.finished = delta['finished']
+            if 'position' in delta:
+                title.last_position = delta['position']
+            vfile = vfiles.get(vfid)
+            if vfile is not None:
+                vfile.num_played = (vfile.num_played or 0) + delta['plays']
+                if 'position' in delta:
+                    vfile.last_pos = (int(delta['position'])
+                                      if delta['position'] else None)
+
+    def _apply_days(self, days):
+        existing = dict((x.day, x) for x in DailyHistory.search(
+            DailyHistory.day.in_(days.keys())))
+        for (day, delta) in days.items():
+            stats = existing.get(day)
+            if stats is None:
+                stats = DailyHistory(day=day, plays=0, completed=0,
+                                     watched_seconds=0.0)
+                db_session.add(stats)
+            stats.plays += delta['plays']
+            stats.completed += delta['completed']
+            stats.watched_seconds += delta['watched_seconds']
+
+
+writer = HistoryWriter(config.history_batch_size,
+                       config.history_flush_interval)
+
+
+def record(event, videofile_id=None, position=None, length=None):
+    """ Records a player command with the module's HistoryWriter """
+    writer.record(event, videofile_id, position, length)
+
+
+def recently_watched(limit=10):
+    """ Returns the TitleHistory of the last watched videofiles """
+    return (TitleHistory.query.options(joinedload('videofile'))
+            .order_by(TitleHistory.last_watched.desc())
+            .limit(limit).all())
+
+
+def continue_watching(limit=10):
+    """ Returns the TitleHistory of videofiles that were stopped before
+    they were finished, most recent first.
+    """
+    return (TitleHistory.search(TitleHistory.finished == False,
+                                TitleHistory.last_position > 0)
+            .options(joinedload('videofile'))
+            .order_by(TitleHistory.last_watched.desc())
+            .limit(limit).all())
+
+
+def daily_statistics(days=30):
+    """ Returns the DailyHistory of the last days, oldest first """
+    since = date.today() - timedelta(days=days - 1)
+    return (DailyHistory.search(DailyHistory.day >= since)
+            .order_by(DailyHistory.day).all())
@@ -0,0 +1,234 @@
+from __future__ import absolute_import
+
+import glob
+import logging
+import os
+import re
+import thread
+import urllib2
+from datetime import datetime, timedelta
+from hashlib import sha1
+from StringIO import StringIO
+
+from sqlalchemy import Column, DateTime, String, Unicode
+
+from kinoknecht import config
+from kinoknecht.database import Base, db_session
+from kinoknecht.models import KinoBase, Movie, Show, Episode
+
+# PIL resizes and recompresses the covers, without it the original image
+# is served for every size
+try:
+    from PIL import Image
+except ImportError:
+    try:
+        import Image
+    except ImportError:
+        Image = None
+
+logger = logging.getLogger("kinoknecht.images")
+
+# Covers larger than this are not downloaded
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+# Failed downloads are retried after this time
+RETRY_AFTER = timedelta(days=7)
+DIGEST_REXP = re.compile(r'^[0-9a-f]{40}$')
+CONTENT_TYPES = {'webp': 'image/webp', 'jpg': 'image/jpeg',
+                 'png': 'image/png', 'gif': 'image/gif'}
+# Name of the variant holding the unmodified image, the other sizes are
+# created from it
+ORIGINAL = 'orig'
+
+
+class CoverImage(Base, KinoBase):
+    """ A downloaded cover, stored under the hash of its content """
+    __tablename__ = 'cover_images'
+
+    url = Column(String, unique=True)
+    digest = Column(String, nullable=True)
+    fetched = Column(DateTime)
+    error = Column(Unicode, nullable=True)
+
+    def __repr__(self):
+        return "<CoverImage('%s', '%s')>" % (self.url, self.digest)
+
+
+def _sniff(data):
+    """ Returns the file extension for the image format of data, or None """
+    if data.startswith('\xff\xd8'):
+        return 'jpg'
+    if data.startswith('\x89PNG'):
+        return 'png'
+    if data.startswith('GIF8'):
+        return 'gif'
+    if data.startswith('RIFF') and data[8:12] == 'WEBP':
+        return 'webp'
+    return None
+
+
+def _variant_name(digest, size, ext):
+    return os.path.join(config.image_dir, digest[:2],
+                        '%s-%s.%s' % (digest, size, ext))
+
+
+def _encode(image, box):
+    """ Returns (extension, data) of image shrunk to fit into box, as WebP
+    if PIL supports it and as JPEG otherwise.
+    """
+    image = image.copy()
+    image.thumbnail(box, Image.ANTIALIAS)
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    for (ext, fmt) in (('webp', 'WEBP'), ('jpg', 'JPEG')):
+        out = StringIO()
+        try:
+            image.save(out, fmt, quality=config.image_quality)
+        except (IOError, KeyError):
+            # No encoder for this format
+            continue
+        return (ext, out.getvalue())
+    raise IOError("Cannot encode image!")
+
+
+def _write(path, data):
+    """ Writes data to path atomically, so it is never served half done """
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    # The name must not match the patterns of variant_path
+    tmppath = os.path.join(dirname, '.tmp-%d-%d-%s' % (
+        os.getpid(), thread.get_ident(), os.path.basename(path)))
+    with open(tmppath, 'wb') as f:
+        f.write(data)
+    os.rename(tmppath, path)
+
+
+def _stored(digest, name):
+    return glob.glob(_variant_name(digest, name, '*'))
+
+
+def variant_path(digest, size):
+    """ Returns the path of the stored variant of an image, or None. Sizes
+    that were added to config.image_sizes after the image was stored are
+    created from the original on first use. Falls back to the original if
+    PIL is missing.
+    """
+    if not DIGEST_REXP.match(digest) or size not in config.image_sizes:
+        return None
+    found = _stored(digest, size)
+    if not found:
+        original = _stored(digest, ORIGINAL)
+        if not original or Image is None:
+            return original[0] if original else None
+        with open(original[0], 'rb') as f:
+            data = f.read()
+        try:
+            _store_variants(digest, data)
+        except IOError as e:
+            logger.warning(u"Could not resize image %s: %s" % (digest, e))
+            return None
+        found = _stored(digest, size)
+    return found[0] if found else None
+
+
+def content_type(path):
+    return CONTENT_TYPES.get(path.rsplit('.', 1)[-1],
+                             'application/octet-stream')
+
+
+def _store_variants(digest, data):
+    """ Writes the sizes of config.image_sizes that are missing for the
+    image data with digest. An earlier attempt may have been interrupted.
+    """
+    missing = [(size, box) for (size, box) in config.image_sizes.items()
+               if not _stored(digest, size)]
+    if not missing:
+        return
+    image = Image.open(StringIO(data))
+    image.load()
+    for (size, box) in missing:
+        (ext, encoded) = _encode(image, box)
+        _write(_variant_name(digest, size, ext), encoded)
+
+
+def store_image(data):
+    """ Stores an image, together with its variants in all sizes of
+    config.image_sizes, and returns its digest. Images that are already
+    stored are not processed again.
+    """
+    ext = _sniff(data)
+    if ext is None:
+        raise ValueError("Not an image!")
+    digest = sha1(data).hexdigest()
+    if not _stored(digest, ORIGINAL):
+        _write(_variant_name(digest, ORIGINAL, ext), data)
+    if Image is not None:
+        _store_variants(digest, data)
+    return digest
+
+
+def _incomplete(digest):
+    """ Whether sizes are missing for an image that was stored without its
+    original, so they can't be created on demand.
+    """
+    if Image is None or _stored(digest, ORIGINAL):
+        return False
+    return any(not _stored(digest, size) for size in config.image_sizes)
+
+
+def fetch_cover(url):
+    """ Downloads and stores the cover at url and records the outcome.
+    Returns the digest, or None if the download failed.
+    """
+    cover = CoverImage.query.filter_by(url=url).first()
+    if cover is None:
+        cover = CoverImage(url=url)
+        db_session.add(cover)
+    cover.fetched = datetime.now()
+    try:
+        response = urllib2.urlopen(url, timeout=config.image_fetch_timeout)
+        try:
+            data = response.read(MAX_IMAGE_BYTES + 1)
+        finally:
+            response.close()
+        if len(data) > MAX_IMAGE_BYTES:
+            raise ValueError("Image is too large!")
+        cover.digest = store_image(data)
+        cover.error = None
+    except Exception as e:
+        logger.warning(u"Could not fetch cover %s: %s" % (url, e))
+        cover.error = unicode(e)
+    db_session.commit()
+    return cover.digest
+
+
+def missing_covers():
+    """ Returns the cover URLs that haven't been downloaded yet, without
+    the ones that failed recently. Covers that lack sizes and can't be
+    resized locally are downloaded again.
+    """
+    urls = set()
+    for cls in (Movie, Show, Episode):
+        urls.update(url for (url,) in db_session.query(cls.cover_url)
+                    .filter(cls.cover_url != None).distinct())
+    retry = datetime.now() - RETRY_AFTER
+    for cover in CoverImage.query:
+        if cover.digest and _incomplete(cover.digest):
+            continue
+        if cover.digest or cover.fetched > retry:
+            urls.discard(cover.url)
+    return sorted(urls)
+
+
+def cover_digests(objs):
+    """ Returns a dictionary mapping the cover URLs of objs to the digests
+    of their stored images, with a single query. Objects without covers
+    (like videofiles) are skipped.
+    """
+    urls = set(getattr(obj, 'cover_url', None) for obj in objs)
+    urls.discard(None)
+    if not urls:
+        return {}
+    return dict(db_session.query(CoverImage.url, CoverImage.digest)
+                .filter(CoverImage.url.in_(urls),
+                        CoverImage.digest != None))
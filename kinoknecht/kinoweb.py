@@ -1,9 +1,12 @@
 from __future__ import absolute_import
 
 from sqlalchemy import and_, desc
-from flask import Flask, render_template
+from flask import (Flask, Response, abort, make_response, redirect,
+                   render_template, request, send_file)
 from flaskext.sqlalchemy import Pagination
 
+from kinoknecht import availability, history, images, metrics, similarity
+from kinoknecht.cache import response_cache
 from kinoknecht.models import Videofile, CATEGORIES_CLASSES
 
 
@@ -16,6 +19,8 @@ CATEGORIES_DETAILSTEMPLATES = {'file': 'details_file.html',
                                'show': 'details_show.html',
                                'episode': 'details_episode.html'}
 PER_PAGE = 25
+# Image URLs contain the hash of the image, so they never change
+IMAGE_MAX_AGE = 365 * 24 * 3600
 
 kinowebapp = Flask(__name__)
 
@@ -25,6 +30,31 @@ def get_page_startitem(page):
 def get_page_enditem(page):
     return page * PER_PAGE
 
+def cached_response(render, *keyparts):
+    """Returns the cached page for keyparts, or renders and caches it.
+    Answers with '304 Not Modified' if the client already has the page.
+    """
+    etag = response_cache.key(*keyparts)
+    if etag in request.if_none_match:
+        response = kinowebapp.response_class(status=304)
+    else:
+        page = response_cache.get(etag)
+        if page is None:
+            page = render()
+            response_cache.set(etag, page)
+        response = make_response(page)
+    response.set_etag(etag)
+    return response
+
+@kinowebapp.before_request
+def begin_request_metrics():
+    metrics.begin_request(request.endpoint)
+
+@kinowebapp.after_request
+def end_request_metrics(response):
+    metrics.end_request()
+    return response
+
 @kinowebapp.template_filter('humansize')
 def humansize_filter(s):
     """Converts sizes from bytes to a human readable format"""
@@ -60,10 +90,20 @@ def index():
 def browse(page=1, category='file'):
     if category not in CATEGORIES_CLASSES:
         return ""
+    # Pages mark files on offline storage
+    return cached_response(lambda: render_browse(page, category),
+                           'browse', category, page,
+                           availability.monitor.version)
+
+
+def _unassigned():
+    """ Criterion for the videofiles that belong to no movie or episode """
+    return and_(Videofile.episode == None, Videofile.movie == None)
 
-    elif category == 'unassigned':
-        query = Videofile.query.filter(and_(Videofile.episode == None,
-                                              Videofile.movie == None))
+
+def render_browse(page, category):
+    if category == 'unassigned':
+        query = Videofile.query.filter(_unassigned())
         results = (query.order_by(desc(Videofile.creation_date))
                   [get_page_startitem(page): get_page_enditem(page)])
     else:
@@ -73,7 +113,8 @@ def browse(page=1, category='file'):
     pagination = Pagination(query, page, PER_PAGE, query.count(), results)
     return render_template(CATEGORIES_BROWSETEMPLATES[category],
                             results=results, pagination=pagination,
-                            category=category)
+                            category=category,
+                            covers=images.cover_digests(results))
 
 
 @kinowebapp.route('/search/', methods=['POST'])
@@ -99,7 +140,8 @@ def search(searchstr=None, category='files', field='name', page=1):
     pagination = Pagination(query, page, PER_PAGE, query.count(), results)
     return render_template(CATEGORIES_BROWSETEMPLATES[category],
                            results=results, page=page, pagination=pagination,
-                           category=category)
+                           category=category,
+                           covers=images.cover_digests(results))
 
 
 @kinowebapp.route('/details/<category>/<int:id>')
@@ -110,9 +152,89 @@ def details(category=None, id=None):
         return ""
     if category not in CATEGORIES_CLASSES:
         return ""
+    return cached_response(lambda: render_details(category, id),
+                           'details', category, id)
+
+
+def render_details(category, id):
     dbobj = CATEGORIES_CLASSES[category].get(id)
+    similar = []
+    if category in similarity.CATEGORIES:
+        similar = similarity.more_like_this(category, id)
     return render_template(CATEGORIES_DETAILSTEMPLATES[category], dbobj=dbobj,
-                           category=category)
+                           category=category, similar=similar,
+                           covers=images.cover_digests([dbobj] + similar))
+
+
+@kinowebapp.route('/history')
+def watch_history():
+    """Displays the videofiles to continue watching and the recently
+    watched ones. Not cached, as it changes with every playback.
+    """
+    return render_template('history.html',
+                           continue_watching=history.continue_watching(),
+                           recently_watched=history.recently_watched(),
+                           days=history.daily_statistics(7))
+
+
+@kinowebapp.route('/stream/<category>.ndjson')
+def stream(category=None):
+    """Streams all records of a category as newline-delimited JSON"""
+    if category not in CATEGORIES_CLASSES:
+        return ""
+    schema = CATEGORIES_CLASSES[category].schema()
+    query = schema.query()
+    if category == 'unassigned':
+        query = query.filter(_unassigned())
+    return Response(schema.iter_ndjson(query),
+                    mimetype='application/x-ndjson')
+
+
+@kinowebapp.route('/media/<int:id>')
+def media(id=None):
+    """Sends a videofile, or redirects to the node that serves it"""
+    vfile = Videofile.get(id)
+    if vfile is None:
+        abort(404)
+    if not vfile.available:
+        abort(503)
+    if not vfile.is_local:
+        return redirect(vfile.location())
+    return send_file(vfile.location(), as_attachment=True,
+                     attachment_filename=vfile.name.encode('utf-8'))
+
+
+@kinowebapp.route('/images/<digest>/<size>')
+def image(digest=None, size=None):
+    """Sends a cached cover in one of the sizes from config.image_sizes"""
+    path = images.variant_path(digest, size)
+    if path is None:
+        abort(404)
+    response = send_file(path, mimetype=images.content_type(path),
+                         conditional=True, cache_timeout=IMAGE_MAX_AGE)
+    response.cache_control.public = True
+    return response
+
+
+@kinowebapp.route('/metrics')
+def show_metrics():
+    """Exposes internal metrics in the Prometheus text format"""
+    return Response(metrics.registry.render(),
+                    mimetype='text/plain; version=0.0.4')
+
+
+@kinowebapp.route('/metrics/profile', methods=['GET', 'POST', 'DELETE'])
+def profile():
+    """Controls the sampling profiler: POST starts it (optionally with an
+    'interval' in seconds), DELETE stops it, GET returns the samples
+    collected so far as collapsed stacks.
+    """
+    if request.method == 'POST':
+        metrics.profiler.reset()
+        metrics.profiler.start(float(request.form.get('interval', 0.005)))
+    elif request.method == 'DELETE':
+        metrics.profiler.stop()
+    return Response(metrics.profiler.render(), mimetype='text/plain')
 
 
 @kinowebapp.route('/edit/<category>/<int:id>')
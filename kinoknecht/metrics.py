@@ -0,0 +1,235 @@
+from __future__ import absolute_import
+
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class Counter(object):
+    """ Monotonically increasing value """
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        return [('', self.value)]
+
+
+class Summary(object):
+    """ Count and sum of observed values, mostly durations in seconds """
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start)
+
+    def samples(self):
+        return [('_count', self.count), ('_sum', self.sum)]
+
+
+class Family(object):
+    """ A named metric, with one child metric per combination of label
+    values.
+    """
+
+    def __init__(self, name, kind, doc, labelnames=()):
+        self.name = name
+        self.kind = kind
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._metric_class = Counter if kind == 'counter' else Summary
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        try:
+            return self._children[values]
+        except KeyError:
+            if len(values) != len(self.labelnames):
+                raise ValueError("%s expects the labels %s"
+                                 % (self.name, self.labelnames))
+            with self._lock:
+                return self._children.setdefault(values,
+                                                 self._metric_class())
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.doc),
+                 "# TYPE %s %s" % (self.name, self.kind)]
+        for (values, child) in sorted(self._children.items()):
+            labels = ','.join('%s="%s"' % (k, _escape(v))
+                              for (k, v) in zip(self.labelnames, values))
+            if labels:
+                labels = '{%s}' % labels
+            for (suffix, value) in child.samples():
+                lines.append("%s%s%s %r" % (self.name, suffix, labels,
+                                            value))
+        return '\n'.join(lines)
+
+
+def _escape(value):
+    """ Escapes a label value for the text exposition format """
+    return (unicode(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+class Registry(object):
+    def __init__(self):
+        self.families = []
+
+    def counter(self, name, doc, labelnames=()):
+        family = Family(name, 'counter', doc, labelnames)
+        self.families.append(family)
+        return family
+
+    def summary(self, name, doc, labelnames=()):
+        family = Family(name, 'summary', doc, labelnames)
+        self.families.append(family)
+        return family
+
+    def render(self):
+        """ Returns all metrics in the Prometheus text exposition format """
+        return '\n'.join(f.render() for f in self.families) + '\n'
+
+
+registry = Registry()
+
+SCAN_PHASE_SECONDS = registry.summary(
+    'kinoknecht_scan_phase_seconds',
+    "Time spent in the phases of library scans", ['phase'])
+SCANNED_FILES = registry.counter(
+    'kinoknecht_scanned_files_total',
+    "Video files seen by library scans", ['result'])
+SQL_QUERY_SECONDS = registry.summary(
+    'kinoknecht_sql_query_seconds',
+    "SQL query latencies per request endpoint", ['endpoint'])
+SQL_QUERIES_PER_REQUEST = registry.summary(
+    'kinoknecht_sql_queries_per_request',
+    "Number of SQL queries per request endpoint", ['endpoint'])
+HTTP_REQUEST_SECONDS = registry.summary(
+    'kinoknecht_http_request_seconds',
+    "Request latencies per endpoint", ['endpoint'])
+IMDB_REQUEST_SECONDS = registry.summary(
+    'kinoknecht_imdb_request_seconds',
+    "Latencies of IMDb calls", ['call'])
+PLAYER_COMMAND_SECONDS = registry.summary(
+    'kinoknecht_player_command_seconds',
+    "Round trip times of player commands", ['command'])
+
+
+# SQL statistics of the request handled by the current thread
+_request_stats = threading.local()
+
+
+def begin_request(endpoint):
+    _request_stats.endpoint = endpoint or 'unknown'
+    _request_stats.queries = 0
+    _request_stats.start = time.time()
+
+
+def end_request():
+    """ Records the timings of the request handled by the current thread """
+    endpoint = getattr(_request_stats, 'endpoint', None)
+    if endpoint is None:
+        return
+    HTTP_REQUEST_SECONDS.labels(endpoint).observe(
+        time.time() - _request_stats.start)
+    SQL_QUERIES_PER_REQUEST.labels(endpoint).observe(_request_stats.queries)
+    _request_stats.endpoint = None
+
+
+def instrument_engine(engine):
+    """ Counts and times every SQL statement executed through engine """
+    from sqlalchemy import event
+
+    def before_execute(conn, cursor, statement, params, context, many):
+        context._kinoknecht_start = time.time()
+
+    def after_execute(conn, cursor, statement, params, context, many):
+        elapsed = time.time() - context._kinoknecht_start
+        _request_stats.queries = getattr(_request_stats, 'queries', 0) + 1
+        SQL_QUERY_SECONDS.labels(
+            getattr(_request_stats, 'endpoint', None) or 'other'
+        ).observe(elapsed)
+
+    event.listen(engine, 'before_cursor_execute', before_execute)
+    event.listen(engine, 'after_cursor_execute', after_execute)
+
+
+class SamplingProfiler(object):
+    """ Low-overhead statistical profiler.
+
+    A background thread periodically samples the stacks of all other
+    threads. The result can be fetched in the 'collapsed stack' format
+    used by flamegraph tools.
+    """
+
+    def __init__(self):
+        self.samples = defaultdict(int)
+        self.interval = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=0.005):
+        if self.running:
+            return
+        self.interval = interval
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='kinoknecht-profiler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+
+    def reset(self):
+        self.samples.clear()
+
+    def _run(self):
+        own_ident = threading.current_thread().ident
+        while not self._stop.is_set():
+            for (ident, frame) in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("%s:%s" % (code.co_filename,
+                                            code.co_name))
+                    frame = frame.f_back
+                self.samples[';'.join(reversed(stack))] += 1
+            self._stop.wait(self.interval)
+
+    def render(self):
+        return ''.join("%s %d\n" % (stack, count) for (stack, count) in
+                       sorted(self.samples.items(), key=lambda x: -x[1]))
+
+
+profiler = SamplingProfiler()
@@ -3,6 +3,7 @@ from __future__ import absolute_import
 import os
 import re
 import logging
+import urllib
 from datetime import datetime
 from hashlib import sha1
 from mimetypes import types_map
@@ -11,19 +12,67 @@ import imdb
 from ffvideo import VideoStream
 from sqlalchemy import (Table, Column, Integer, Float, ForeignKey,
                         String, Unicode, Text, DateTime, and_)
-from sqlalchemy.orm import relationship, synonym
+from sqlalchemy.orm import backref, object_session, relationship, synonym
+from sqlalchemy.orm.util import identity_key
 from sqlalchemy.schema import UniqueConstraint
 from sqlalchemy.ext.declarative import declared_attr
 
-from kinoknecht import config
+from kinoknecht import availability, config
+from kinoknecht.metrics import SCAN_PHASE_SECONDS, SCANNED_FILES, \
+                               IMDB_REQUEST_SECONDS
+from kinoknecht.cache import response_cache
 from kinoknecht.database import Base, db_session
 from kinoknecht.helpers import to_unicode, imdbcontainer_to_json
+from kinoknecht.nameparser import parse_name
+from kinoknecht.serializers import schema_for
 
 
 
 imdb = imdb.IMDb()
 logger = logging.getLogger("kinoknecht.models")
 
+SUBTITLE_TYPES = ('.srt', '.ass', '.sub')
+# Names of subfolders that only contain subtitles
+SUBTITLE_DIRS = ('subs', 'subtitles')
+# Language suffixes, as in 'Movie.en.srt' or 'Movie_German.srt'
+SUBTITLE_LANG_REXP = re.compile(
+    r'(?P<basename>.+)[._\- ](?P<language>[A-Za-z]{2,12})$')
+# Suffixes accepted as languages: ISO 639-1 and 639-2 codes and names,
+# so that 'The Meaning of Life.srt' or 'Movie.forced.srt' aren't mistaken
+# for subtitles in 'life' or 'forced'
+SUBTITLE_LANGUAGES = frozenset('''
+    ar ara arabic bg bul bulgarian cs ces cze czech da dan danish
+    de deu ger german el ell gre greek en eng english es spa spanish
+    et est estonian fa fas per persian fi fin finnish fr fra fre french
+    he heb hebrew hi hin hindi hr hrv croatian hu hun hungarian
+    id ind indonesian is isl ice icelandic it ita italian ja jpn japanese
+    ko kor korean lt lit lithuanian lv lav latvian nl nld dut dutch
+    no nor norwegian pl pol polish pt por portuguese ro ron rum romanian
+    ru rus russian sk slk slo slovak sl slv slovenian sr srp serbian
+    sv swe swedish th tha thai tr tur turkish uk ukr ukrainian
+    vi vie vietnamese zh zho chi chinese
+'''.split())
+# Videofile fields determined by examining the file itself, these are
+# shipped by the scan agents of other nodes
+PROBED_FIELDS = ('size', 'creation_date', 'sha1hash', 'length',
+                 'video_width', 'video_height', 'video_format',
+                 'video_bitrate', 'video_fps', 'audio_format',
+                 'audio_bitrate')
+
+
+def is_local_node(node):
+    return node is None or node == config.node_name
+
+
+def node_url(node, path):
+    """ Returns path if it's on this node, otherwise the URL under which the
+    scan agent of node serves it.
+    """
+    if is_local_node(node):
+        return path
+    return '%s/files%s' % (config.nodes[node].rstrip('/'),
+                           urllib.quote(to_unicode(path).encode('utf-8')))
+
 
 class KinoBase(object):
     """ Base class for all of our publicly accessible data types. """
@@ -34,6 +83,19 @@ class KinoBase(object):
     def get(cls, id):
         return cls.query.get(id)
 
+    @classmethod
+    def get_many(cls, ids):
+        """ Returns a dictionary mapping id -> object for all existing ids,
+        using as few queries as possible.
+        """
+        ids = list(set(int(x) for x in ids))
+        objs = {}
+        # SQLite doesn't allow more than 999 parameters per statement
+        for idx in range(0, len(ids), 900):
+            objs.update((obj.id, obj) for obj in
+                        cls.query.filter(cls.id.in_(ids[idx:idx+900])))
+        return objs
+
     @classmethod
     def search(cls, *sparams):
         if not sparams:
@@ -51,19 +113,16 @@ class KinoBase(object):
         """
         raise NotImplementedError("This should have been implemented!")
 
+    @classmethod
+    def schema(cls):
+        """ Returns the serialization schema for this class. """
+        return schema_for(cls)
+
     def get_infodict(self, *keys):
         """ Return dictionary with values for all specified keys, or all
         public fields if no keys are specified.
         """
-        if not keys:
-            keys = self.__dict__.keys()
-        for key in keys:
-            if key not in self.__dict__.keys():
-                raise KeyError
-        return dict(
-            (k, v) for (k, v) in self.__dict__.iteritems()
-            if not k.startswith('_') and k in keys
-            )
+        return self.schema().dump(self, *keys)
 
 
 class MetadataMixin(object):
@@ -99,15 +158,19 @@ class MetadataMixin(object):
         """
         if not self.imdb_id:
             raise ValueError('self.imdb_id is not specified!')
-        meta = imdb.get_movie(self.imdb_id)
-        imdb.update(meta)
+        with IMDB_REQUEST_SECONDS.labels('get_movie').time():
+            meta = imdb.get_movie(self.imdb_id)
+        with IMDB_REQUEST_SECONDS.labels('update').time():
+            imdb.update(meta)
 
         # Fields that are named differently than in the IMDbPy object
         imdbmap = {
             'smart canonical title': 'title',
             'color info': 'color_info',
             'akas': 'alt_titles',
-            'full-size cover url': 'cover_url'
+            'full-size cover url': 'cover_url',
+            'genres': 'imdb_genres',
+            'rating': 'imdb_rating'
         }
 
         for imdbkey in meta.keys():
@@ -139,12 +202,14 @@ class Videofile(Base, KinoBase):
     to it """
     __tablename__ = 'videofiles'
     __table_args__ = (
-        UniqueConstraint('name', 'path'),
+        UniqueConstraint('node', 'name', 'path'),
         {}
     )
 
     videodirs = config.video_dirs
 
+    # Storage node the file lives on, see config.nodes
+    node = Column(Unicode)
     name = Column(Unicode)
     path = Column(Unicode)
     size = Column(Integer)
@@ -169,22 +234,34 @@ class Videofile(Base, KinoBase):
     # Synonym for 'name' to facilitate generic item rendering in frontends
     title = synonym("name")
 
-    def __init__(self, path, fname):
+    def __init__(self, path, fname, node=None, **specs):
+        """ Creates the Videofile for fname in path. Files on other nodes
+        can't be examined from here, their specs (see PROBED_FIELDS) are
+        passed in as keyword arguments instead.
+        """
+        self.name = unicode(fname)
+        self.node = unicode(node or config.node_name)
+        if not self.is_local:
+            self.path = unicode(path)
+            for field in PROBED_FIELDS:
+                setattr(self, field, specs.get(field))
+            return
         path = os.path.abspath(path)
         fullpath = os.path.join(path, fname)
-        self.name = unicode(fname)
         self.path = unicode(path)
         self.size = os.path.getsize(fullpath)
         self.creation_date = datetime.fromtimestamp(
             os.path.getctime(fullpath))
         # For performance reasons, we only hash the first 1MB of each file
-        with open(fullpath, 'r+b') as f:
-            self.sha1hash = sha1(f.read(1048576)).hexdigest()
+        with SCAN_PHASE_SECONDS.labels('hash').time():
+            with open(fullpath, 'r+b') as f:
+                self.sha1hash = sha1(f.read(1048576)).hexdigest()
 
         try: 
             # FFVideo can't seem to handle Unicode strings, so we use
             # UTF-8 byte strings.
-            ffobj = VideoStream(fullpath.encode('UTF-8'))
+            with SCAN_PHASE_SECONDS.labels('probe').time():
+                ffobj = VideoStream(fullpath.encode('UTF-8'))
             self.length = ffobj.duration
             self.video_width = ffobj.width
             self.video_height = ffobj.height
@@ -193,19 +270,39 @@ class Videofile(Base, KinoBase):
         except:
             logger.error(u"Video specs of %s cannot be determined!" % fname)
 
-        logger.info(u"Added %s to database!" % to_unicode(fname))
+        logger.debug(u"Added %s to database!" % to_unicode(fname))
 
     def __repr__(self):
         return "<Videofile('%s', '%s')>" % (self.name, self.path)
 
+    @property
+    def is_local(self):
+        return is_local_node(self.node)
+
+    @property
+    def available(self):
+        """ Whether the file's storage is online, as of the last probe """
+        if self.is_local:
+            return availability.path_available(self.path)
+        return availability.node_available(self.node)
+
+    def location(self):
+        """ Returns the path of the file, or its URL if it's on another node
+        """
+        return node_url(self.node, os.path.join(self.path, self.name))
+
     @classmethod
-    def browse(cls, path=None):
-        # Return list of root-level video directories (as specified in config)
+    def browse(cls, path=None, node=None):
+        node = node or config.node_name
         if not path:
-            return [[x for x in cls.videodirs], []]
-
-        qresult = cls.query.filter(
-            cls.path.like('%' + path + '%'))
+            # Return list of root-level video directories (as specified in
+            # config, or as found by the scan agent of another node)
+            if is_local_node(node):
+                return [[x for x in cls.videodirs], []]
+            return [cls._node_roots(node), []]
+
+        qresult = cls.query.filter(and_(
+            cls.node == node, cls.path.like('%' + path + '%')))
         # Get subdirs
         subdirs = []
         for i in qresult:
@@ -214,9 +311,19 @@ class Videofile(Base, KinoBase):
                 subdirs.append(i.path)
         # Get videofiles
         vfiles = [vfile for vfile in
-                  cls.query.filter_by(path=path)]
+                  cls.query.filter_by(node=node, path=path)]
         return [subdirs, vfiles]
 
+    @classmethod
+    def _node_roots(cls, node):
+        """ Returns the topmost directories with videofiles on node """
+        roots = []
+        for (path,) in db_session.query(cls.path).filter_by(
+                node=node).distinct().order_by(cls.path):
+            if not any(path.startswith(root + os.sep) for root in roots):
+                roots.append(path)
+        return roots
+
     @classmethod
     def update_all(cls):
         for vdir in cls.videodirs:
@@ -231,50 +338,146 @@ class Videofile(Base, KinoBase):
         return statdict
 
     @classmethod
-    def update_files(cls, path):
-        """ Search recursively in path for supported video files. """
-        logger.info(u"Scanning directory '%s' for video files" % path)
-        scanobjs = []
-        vidtree = cls._find_videofiles(path)
-        for viddir in vidtree.keys():
-            for vidfile in vidtree[viddir]:
+    def update_files(cls, path, chunk_size=None, on_chunk=None):
+        """ Search recursively in path for supported video files.
+
+        The tree is processed one directory at a time. Whenever a directory
+        is complete and at least chunk_size (config.scan_chunk_size) new
+        files are pending, they are committed together with a checkpoint,
+        so memory use doesn't grow with the size of the library and an
+        interrupted scan of path resumes after the last committed
+        directory. on_chunk is called with the number of files added so
+        far after every chunk, it may raise to abort the scan.
+        """
+        chunk_size = chunk_size or config.scan_chunk_size
+        root = unicode(os.path.abspath(path))
+        # The state is kept per configured video directory, scans of
+        # subdirectories probe the directory they belong to
+        if not availability.monitor.probe_root(availability.root_for(root)
+                                               or root):
+            logger.warning(u"Not scanning '%s', it is offline" % path)
+            return
+        checkpoint = ScanCheckpoint.query.filter_by(root=root).first()
+        if checkpoint is None:
+            logger.info(u"Scanning directory '%s' for video files" % path)
+            checkpoint = ScanCheckpoint(root)
+            db_session.add(checkpoint)
+            db_session.commit()
+        else:
+            logger.info(u"Resuming scan of '%s' after '%s'"
+                        % (path, checkpoint.last_dir))
+        (last_dir, added) = (checkpoint.last_dir, checkpoint.added)
+        pending = 0
+        # Objects the caller holds stay in the session, only the ones the
+        # scan loads or creates are dropped after each chunk
+        held = set(db_session.identity_map.keys())
+        chunk = []
+        for (viddir, vidfiles, subfiles) in _timed(
+                cls._walk_videofiles(root, last_dir), 'walk'):
+            subindex = _index_subtitles(subfiles, len(vidfiles) == 1)
+            existing = cls._existing_files(vidfiles)
+            for vfobjs in existing.values():
+                chunk.extend(vfobjs)
+            for vidfile in vidfiles:
                 # Does the file already exist in the db?
-                dbentries = cls.query.filter_by(name=unicode(vidfile),
-                        size=os.path.getsize(os.path.join(viddir, vidfile)))
-                if not dbentries.count():
+                size = os.path.getsize(os.path.join(viddir, vidfile))
+                dbentries = [vfobj for vfobj in existing.get(vidfile, [])
+                             if vfobj.size == size]
+                if not dbentries:
                     try:
-                        vfobj = Videofile(os.path.abspath(viddir), vidfile)
-                        vfobj.find_subtitle()
-                        scanobjs.append(vfobj)
+                        vfobj = Videofile(viddir, vidfile)
+                        with SCAN_PHASE_SECONDS.labels('subtitle').time():
+                            vfobj.find_subtitle(subindex)
+                        db_session.add(vfobj)
+                        chunk.append(vfobj)
+                        pending += 1
+                        SCANNED_FILES.labels('added').inc()
                     except IOError as e:
+                        SCANNED_FILES.labels('failed').inc()
                         logger.error(e)
                 else:
                     # Seems like it, see if there's something to update
-                    # like it, see if there's something to update
+                    SCANNED_FILES.labels('existing').inc()
                     for vfobj in dbentries:
-                        vfobj._check_path(os.path.abspath(viddir))
-        db_session.add_all(scanobjs)
-        db_session.commit()
+                        vfobj._check_path(viddir)
+                        if vfobj.path == viddir:
+                            # Picks up subtitles added since the last scan
+                            vfobj.find_subtitle(subindex)
+            last_dir = viddir
+            # Chunks end with complete directories, which is what the
+            # checkpoint records
+            if pending >= chunk_size:
+                added += pending
+                pending = 0
+                _commit_scan_chunk(root, last_dir, added, on_chunk, chunk,
+                                   held)
+                chunk = []
+        with SCAN_PHASE_SECONDS.labels('commit').time():
+            ScanCheckpoint.query.filter_by(root=root).delete()
+            db_session.commit()
+        response_cache.bump()
+        logger.info(u"Added %d new video files from '%s'"
+                    % (added + pending, path))
 
     @classmethod
-    def _find_videofiles(cls, path):
-        """ Walk the filetree to find videofiles """
+    def _existing_files(cls, names):
+        """ Returns a dictionary mapping each of names to the Videofiles of
+        this node with that name, in any directory.
+        """
+        existing = {}
+        # SQLite doesn't allow more than 999 parameters per statement
+        for idx in range(0, len(names), 900):
+            for vfobj in cls.search(
+                    cls.node == unicode(config.node_name),
+                    cls.name.in_(names[idx:idx+900])):
+                existing.setdefault(vfobj.name, []).append(vfobj)
+        return existing
+
+    @classmethod
+    def _walk_videofiles(cls, path, resume_after=None):
+        """ Walk the filetree to find videofiles. Yields a tuple with the
+        directory, the names of the videofiles and the names of the
+        subtitles in it (including those in subtitle subfolders, relative
+        to the directory) for every directory with videofiles.
+
+        Directories are visited in a stable order. If resume_after is
+        given, it and all directories before it are skipped.
+        """
         # Get video filetypes from the MIME database and add some own ones
         ftypes = [k for (k, v) in types_map.iteritems() if 'video' in v]
         ftypes = tuple(ftypes + [i for i in
                                ['.wmv', '.flv', '.mkv', '.rm', '.m2v']
                                if i not in ftypes
                               ])
-        filedict = {}
+        resume_key = resume_after and _walk_key(resume_after)
 #        for root, dirs, files in os.walk(to_unicode(path)):
         for root, dirs, files in os.walk(unicode(path)):
+            # Sorted children make the walk order equal to the order of
+            # the _walk_keys
+            dirs.sort()
             matchlist = []
+            sublist = []
             for name in files:
                 if name.endswith(ftypes):
                     matchlist.append(name)
+                elif name.lower().endswith(SUBTITLE_TYPES):
+                    sublist.append(name)
+            # Collect the contents of subtitle folders right away and don't
+            # descend into them on our own
+            for subdir in [d for d in dirs if d.lower() in SUBTITLE_DIRS]:
+                dirs.remove(subdir)
+                sublist.extend(os.path.join(subdir, name) for name in
+                               os.listdir(os.path.join(root, subdir))
+                               if name.lower().endswith(SUBTITLE_TYPES))
+            if resume_key:
+                if _walk_key(root) <= resume_key:
+                    matchlist = []
+                # Don't descend into subtrees that were scanned completely
+                dirs[:] = [d for d in dirs
+                           if not _scanned_before(_walk_key(
+                               os.path.join(root, d)), resume_key)]
             if len(matchlist) > 0:
-                filedict[root] = matchlist
-        return filedict
+                yield (root, matchlist, sublist)
 
 
     def _check_path(self, path):
@@ -285,12 +488,16 @@ class Videofile(Base, KinoBase):
         if path == self.path:
             # Nothing to update here!
             return
+        if not availability.path_available(self.path):
+            # The old location might just be offline, don't wait for it
+            return
         if not os.path.exists(os.path.join(self.path, self.name)):
             self.path = path
             logger.info(u"Updated video file %s" % self.name)
         else:
             # Seems we have a duplicate!
-            if Videofile.query.filter_by(name=self.name, path=path).count():
+            if Videofile.query.filter_by(node=self.node, name=self.name,
+                                         path=path).count():
                 logger.error(u"File at '%s' already exists in"
                 "the database, might be a duplicate, will not be added!"
                 % os.path.join(path, self.name))
@@ -302,16 +509,161 @@ class Videofile(Base, KinoBase):
             db_session.add(new_vfobj)
             db_session.commit()
 
-    def find_subtitle(self):
-        """ Find subtitle files for the Videofile. """
-        ftypes = ('.srt', '.ass', '.sub')
-        # Subtitles with the same basename as the corresponding videofile
+    def find_subtitle(self, subindex=None):
+        """ Find subtitle files for the Videofile.
+
+        subindex is the result of _index_subtitles for the files in the
+        Videofile's directory, it is built from a fresh directory listing
+        if not specified.
+        """
+        if subindex is None:
+            if not self.available:
+                return
+            subfiles = [f for f in os.listdir(self.path)
+                        if f.lower().endswith(SUBTITLE_TYPES)]
+            subindex = _index_subtitles(subfiles)
         basename = os.path.splitext(self.name)[0]
-        for f in os.listdir(self.path):
-            (fname, fext) = os.path.splitext(f)
-            if fname == basename and fext in ftypes:
-                self.subfilepath = os.path.join(self.path, f)
-                logger.info("Added subtitle for %s" % to_unicode(self.name))
+        # Matches by name come first, so a file in a subtitle folder that
+        # is also stored under None keeps the language from its name
+        candidates = subindex.get(basename, []) + subindex.get(None, [])
+        if not candidates:
+            return
+        known = set(sub.path for sub in self.subtitles)
+        for (subfile, language) in candidates:
+            subpath = os.path.join(self.path, subfile)
+            if subpath not in known:
+                self.add_subtitle(subpath, language)
+                known.add(subpath)
+
+    def add_subtitle(self, subpath, language=None):
+        self.subtitles.append(Subtitle(subpath, language))
+        # Subtitles with the same basename as the videofile are the
+        # default
+        if not self.subfilepath or not language:
+            self.subfilepath = subpath
+        logger.debug("Added subtitle for %s" % to_unicode(self.name))
+
+
+def _walk_key(path):
+    return path.split(os.sep)
+
+
+def _scanned_before(key, resume_key):
+    """ Tells whether the whole subtree at key comes before resume_key in
+    the order of _walk_videofiles.
+    """
+    return key < resume_key and resume_key[:len(key)] != key
+
+
+def _timed(iterable, phase):
+    """ Yields the items of iterable, timing their production as the given
+    scan phase.
+    """
+    iterator = iter(iterable)
+    while True:
+        with SCAN_PHASE_SECONDS.labels(phase).time():
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def _commit_scan_chunk(root, last_dir, added, on_chunk=None, objs=(),
+                       held=frozenset()):
+    """ Commits the pending files of a scan together with its checkpoint,
+    then removes objs from the session, except for those whose identity
+    is in held.
+    """
+    with SCAN_PHASE_SECONDS.labels('commit').time():
+        ScanCheckpoint.query.filter_by(root=root).update(
+            dict(last_dir=last_dir, added=added, updated=datetime.now()),
+            synchronize_session=False)
+        db_session.commit()
+        # Don't let the session's identity map grow with the library
+        for obj in objs:
+            if object_session(obj) is not None and \
+                    identity_key(instance=obj) not in held:
+                db_session.expunge(obj)
+    response_cache.bump()
+    if on_chunk is not None:
+        on_chunk(added)
+
+
+def _index_subtitles(subfiles, single_video=False):
+    """ Maps video basenames to lists of (subtitle file, language) tuples
+    for the subtitle files in subfiles, which may either be named exactly
+    like the videofile ('Movie.srt') or carry a language suffix
+    ('Movie.en.srt', 'Movie_German.srt').
+
+    If the directory only holds a single videofile (single_video), the
+    files in subtitle folders are matched to it regardless of their name,
+    with their basename as language ('Subs/English.srt'). These are
+    stored under the key None.
+
+    Only suffixes in SUBTITLE_LANGUAGES are taken as languages.
+    """
+    index = {}
+    for subfile in subfiles:
+        stem = os.path.splitext(os.path.basename(subfile))[0]
+        index.setdefault(stem, []).append((subfile, None))
+        match = SUBTITLE_LANG_REXP.match(stem)
+        if match and match.group('language').lower() in SUBTITLE_LANGUAGES:
+            index.setdefault(match.group('basename'), []).append(
+                (subfile, match.group('language').lower()))
+        if single_video and os.path.dirname(subfile):
+            language = stem.lstrip('0123456789_ ').lower()
+            index.setdefault(None, []).append(
+                (subfile, language if language in SUBTITLE_LANGUAGES
+                 else None))
+    return index
+
+
+class Subtitle(Base, KinoBase):
+    """ A subtitle file belonging to a Videofile """
+    __tablename__ = 'subtitles'
+
+    path = Column(Unicode)
+    language = Column(Unicode, nullable=True)
+    videofile_id = Column(Integer, ForeignKey('videofiles.id'))
+    videofile = relationship('Videofile', backref=backref(
+        'subtitles', cascade='all, delete-orphan'))
+
+    def __init__(self, path, language=None):
+        self.path = unicode(path)
+        if language:
+            self.language = unicode(language)
+
+    def __repr__(self):
+        return "<Subtitle('%s', '%s')>" % (self.path, self.language)
+
+    def location(self):
+        """ Returns the path of the subtitle, or its URL if it's on another
+        node
+        """
+        return node_url(self.videofile.node, self.path)
+
+
+class ScanCheckpoint(Base, KinoBase):
+    """ Progress of a scan of a video directory, kept until the scan is
+    complete so an interrupted scan can be resumed.
+    """
+    __tablename__ = 'scan_checkpoints'
+
+    root = Column(Unicode, unique=True)
+    # The last directory whose files are all committed
+    last_dir = Column(Unicode, nullable=True)
+    added = Column(Integer, default=0)
+    started = Column(DateTime)
+    updated = Column(DateTime)
+
+    def __init__(self, root):
+        self.root = root
+        self.added = 0
+        self.started = self.updated = datetime.now()
+
+    def __repr__(self):
+        return "<ScanCheckpoint('%s', '%s')>" % (self.root, self.last_dir)
 
 
 class Show(Base, KinoBase, MetadataMixin):
@@ -355,33 +707,19 @@ class Episode(Base, KinoBase, MetadataMixin):
     show_id = Column(Integer, ForeignKey('shows.id'))
 
     def __init__(self, vfile):
-        #TODO: Make regexps more robust, eg for tp02.avi (S0E2),
-        #      skins1x07 (S1E7), skins_s1_e8 (S1E8),
-        #      seinfeld.7x17.the_doll.avi, files without any season/episode
-        rexps = [
-            re.compile(
-        r'(?P<basename>.*)(?:S(?P<season>\d+)E(?P<episode>\d+)).*', re.I),
-            re.compile(
-        r'(?P<basename>.*)(?P<season>\d)(?P<episode>\d{2,3}).*', re.I),
-            re.compile(
-        r'(?P<basename>.*)(?P<season>\d+)x(?P<episode>\d+).*', re.I)
-        ]
-        for r in rexps:
-            m = r.match(vfile.name)
-            if m:
-                break
-        if m:
-            season_num = m.group('season')
-            episode_num = m.group('episode')
-            if season_num: self.season_num = season_num
-            if episode_num: self.episode_num = episode_num
+        parsed = parse_name(vfile.name, is_episode=True)
+        if parsed.season is not None:
+            self.season_num = parsed.season
+        if parsed.episode is not None:
+            self.episode_num = parsed.episode
         self.videofiles.append(vfile)
 
     def __repr__(self):
         return "<Episode('%d', '%d')>" % (self.episode_num, self.videofile_id)
 
     def get_meta_from_show(self):
-        show_episodes = self._imdb.get_movie_episodes(show.imdb_id)
+        with IMDB_REQUEST_SECONDS.labels('get_movie_episodes').time():
+            show_episodes = imdb.get_movie_episodes(self.show.imdb_id)
         self.imdb_id = (show_episodes['data']['episodes'][int(self.season_num)]
                         [int(self.episode_num)].movieID)
         self.update_metadata()
@@ -0,0 +1,225 @@
+from __future__ import absolute_import
+
+import os
+import re
+from collections import defaultdict, namedtuple
+
+from kinoknecht.helpers import to_unicode
+
+ParsedName = namedtuple('ParsedName',
+                        'title year season episode part tags')
+
+EXTENSIONS = frozenset(['.avi', '.mkv', '.mpg', '.mpeg', '.mp4', '.m4v',
+                        '.wmv', '.flv', '.mov', '.ogm', '.rm', '.m2v',
+                        '.divx', '.ts', '.vob', '.iso', '.srt', '.sub',
+                        '.ass'])
+
+# Everything from the first release tag on is considered release
+# information. Technical tags are never part of a title, word tags (like
+# 'Proper' or 'German') only count after a year or next to technical tags.
+RELEASE_TAGS = re.compile(r'''(?:^|(?<=[\s\[\(\-\.]))(?:(?P<technical>
+    dvdrip|dvdscr|dvd5|dvd9|dvd|bdrip|brrip|bluray|blu-ray|hdrip|hdtv|pdtv|
+    web-?dl|webrip|tvrip|vhsrip|r5|telesync|
+    xvid|divx|x264|h\s?264|hevc|x265|
+    480p|576p|720p|1080p|1080i|
+    ac3|dts|aac|mp3|5\.1|repack
+    )|(?P<word>
+    proper|limited|unrated|extended|remastered|internal|ts|cam|
+    dubbed|subbed|multi|german|french|ger|eng
+    ))(?=$|[\s\]\)\-\.])''', re.I | re.X)
+# What may stand between two release tags of the same group
+TAG_GAP_REXP = re.compile(r'^[\s\[\]\(\)\-]*$')
+
+# Season/episode markers, in order of reliability
+EPISODE_REXPS = [
+    # S01E04, s1_e8, S01.E04
+    re.compile(r'\bs(?P<season>\d{1,2})[\s_\-]?e(?P<episode>\d{1,3})', re.I),
+    # 1x07, 7x17
+    re.compile(r'(?:\b|(?<=[a-z]))(?P<season>\d{1,2})x(?P<episode>\d{2,3})\b',
+               re.I),
+    # Season 1 Episode 4
+    re.compile(r'\bseason\s*(?P<season>\d{1,2})\s*episode\s*'
+               r'(?P<episode>\d{1,3})', re.I),
+]
+# 108 (S1E08), only for names known to be episodes, as it would take
+# titles like 'Room 237' apart
+BARE_EPISODE_REXP = re.compile(r'\b(?P<season>[1-9])(?P<episode>\d{2})\b')
+PART_REXP = re.compile(r'\b(?:cd|disc|disk|dvd|part|pt)\s*(?P<part>\d{1,2})\b',
+                       re.I)
+YEAR_PREFIX_REXP = re.compile(r'^(?P<year>(?:19|20)\d\d)\s*-\s*')
+YEAR_REXP = re.compile(r'(?<!\d)(?:19|20)\d\d(?!\d)')
+# Dots and underscores, but not the dots in numbers like '5.1'
+SEPARATOR_REXP = re.compile(r'_+|(?<!\d)\.|\.(?!\d\b)')
+SPACE_REXP = re.compile(r'\s+')
+TRAILING_REXP = re.compile(r'[\s\-\(\[\{,:;]+$')
+
+
+def _normalize(fname):
+    fname = to_unicode(fname)
+    (base, ext) = os.path.splitext(fname)
+    if ext.lower() in EXTENSIONS:
+        fname = base
+    return SPACE_REXP.sub(u' ', SEPARATOR_REXP.sub(u' ', fname)).strip()
+
+
+def _cleanup(title):
+    return TRAILING_REXP.sub(u'', title).strip(u' -')
+
+
+def _release_tags(name):
+    """ Returns the release tag matches in name, leaving out word tags that
+    are probably part of the title.
+    """
+    matches = list(RELEASE_TAGS.finditer(name))
+    year = YEAR_REXP.search(name, 1)
+    accepted = []
+    for (idx, match) in enumerate(matches):
+        if match.group('word'):
+            after_year = year and year.end() <= match.start()
+            after_technical = any(m.group('technical')
+                                  for m in matches[:idx])
+            # 'German DVDRip': followed by technical tags
+            before_technical = False
+            end = match.end()
+            for following in matches[idx + 1:]:
+                if not TAG_GAP_REXP.match(name[end:following.start()]):
+                    break
+                if following.group('technical'):
+                    before_technical = True
+                    break
+                end = following.end()
+            if not (after_year or after_technical or before_technical):
+                continue
+        accepted.append(match)
+    return accepted
+
+
+def parse_name(fname, is_episode=False):
+    """ Extracts title, year, season and episode number, part number and
+    release tags from a (video) filename. Fields that can't be determined
+    are None, tags is a (possibly empty) list. Names of files known to be
+    episodes (is_episode) may also carry bare episode numbers like '108'.
+    """
+    name = _normalize(fname)
+    year = season = episode = part = None
+
+    # Release information, like 'DVDRip XviD-GRP'
+    matches = _release_tags(name)
+    tags = [m.group() for m in matches]
+    if matches:
+        name = name[:matches[0].start()]
+
+    match = YEAR_PREFIX_REXP.match(name)
+    if match:
+        # '1938 - Opfergang'
+        year = int(match.group('year'))
+        name = name[match.end():]
+
+    rexps = EPISODE_REXPS + ([BARE_EPISODE_REXP] if is_episode else [])
+    for rexp in rexps:
+        match = rexp.search(name)
+        # Don't take a leading number ('300') for an episode
+        if match and match.start():
+            season = int(match.group('season'))
+            episode = int(match.group('episode'))
+            name = name[:match.start()]
+            break
+
+    match = PART_REXP.search(name)
+    if match and match.start():
+        part = int(match.group('part'))
+        name = name[:match.start()] + name[match.end():]
+
+    if year is None:
+        for match in YEAR_REXP.finditer(name):
+            if not match.start():
+                # The year is part of the title, like '2001 A Space Odyssey'
+                continue
+            year = int(match.group())
+            # '(Oshima 1974)': cut at the opening parenthesis
+            opening = name.rfind(u'(', 0, match.start())
+            if opening > -1 and u')' not in name[opening:match.start()]:
+                name = name[:opening]
+            else:
+                name = name[:match.start()]
+            break
+
+    name = _cleanup(name)
+    if season is None and u' - ' in name:
+        # 'Director - Title'
+        name = name.split(u' - ', 1)[1]
+    return ParsedName(_cleanup(name) or _normalize(fname), year, season,
+                      episode, part, tags)
+
+
+def parse_names(fnames, is_episode=False):
+    """ Parses many filenames at once, identical names are only parsed
+    once. Returns a list of ParsedNames in the same order.
+    """
+    seen = {}
+    results = []
+    for fname in fnames:
+        try:
+            results.append(seen[fname])
+        except KeyError:
+            results.append(seen.setdefault(fname,
+                                           parse_name(fname, is_episode)))
+    return results
+
+
+def trigrams(title):
+    """ Returns the set of character trigrams of a title, ignoring case
+    and punctuation.
+    """
+    title = u' %s ' % u' '.join(re.findall(r'\w+', to_unicode(title).lower(),
+                                           re.U))
+    return set(title[i:i + 3] for i in range(len(title) - 2))
+
+
+class TitleIndex(object):
+    """ Trigram index over titles for fuzzy matching.
+
+    Candidates are found through posting lists, so a lookup only touches
+    titles sharing at least one trigram with the query and is ranked by
+    the Dice coefficient of both trigram sets.
+    """
+
+    def __init__(self, entries=()):
+        self._postings = defaultdict(list)
+        self._entries = []
+        self._sizes = []
+        for (key, title) in entries:
+            self.add(key, title)
+
+    def add(self, key, title):
+        if not title:
+            return
+        grams = trigrams(title)
+        idx = len(self._entries)
+        self._entries.append((key, title))
+        self._sizes.append(len(grams))
+        for gram in grams:
+            self._postings[gram].append(idx)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def match(self, title, limit=3, threshold=0.5):
+        """ Returns up to limit (key, title, score) tuples for the indexed
+        titles most similar to title, best match first.
+        """
+        grams = trigrams(title)
+        if not grams:
+            return []
+        shared = defaultdict(int)
+        for gram in grams:
+            for idx in self._postings.get(gram, ()):
+                shared[idx] += 1
+        scored = []
+        for (idx, count) in shared.iteritems():
+            score = 2.0 * count / (len(grams) + self._sizes[idx])
+            if score >= threshold:
+                scored.append((score, idx))
+        scored.sort(reverse=True)
+        return [self._entries[idx] + (score,)
+                for (score, idx) in scored[:limit]]
@@ -0,0 +1,383 @@
+from __future__ import absolute_import
+
+import ctypes
+import logging
+import os
+import platform
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from sqlalchemy import (Column, Boolean, DateTime, Float, Index, Integer,
+                        String, Text, Unicode)
+
+from kinoknecht import config, images
+from kinoknecht.cache import response_cache
+from kinoknecht.database import Base, db_session
+from kinoknecht.models import (KinoBase, Videofile, Show,
+                               CATEGORIES_CLASSES)
+from kinoknecht.serializers import dumps, json
+
+logger = logging.getLogger("kinoknecht.scheduler")
+
+# ioprio_set syscall numbers, see linux/ioprio.h
+IOPRIO_SYSCALLS = {'x86_64': 251, 'i386': 289, 'i686': 289,
+                   'armv7l': 314, 'aarch64': 30}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+
+# Minimum number of seconds between two progress log messages of a job
+PROGRESS_LOG_INTERVAL = 10
+
+
+class JobCancelled(Exception):
+    """ Raised inside a job when it has been cancelled """
+
+
+class ScheduledJob(Base, KinoBase):
+    """ A maintenance job, persisted so queued and recurring jobs survive
+    restarts.
+    """
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        Index('ix_jobs_status_run_after', 'status', 'run_after'),
+        {}
+    )
+
+    type = Column(String)
+    params = Column(Text)
+    priority = Column(Integer, default=0)
+    status = Column(String, default='queued')
+    progress = Column(Float, default=0.0)
+    message = Column(Unicode, nullable=True)
+    error = Column(Unicode, nullable=True)
+    # Only start the job during the off-peak hours
+    offpeak = Column(Boolean, default=False)
+    # Re-queue the job this many seconds after it finished
+    interval = Column(Integer, nullable=True)
+    created = Column(DateTime)
+    run_after = Column(DateTime)
+    started = Column(DateTime, nullable=True)
+    finished = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return "<ScheduledJob('%s', '%s')>" % (self.type, self.status)
+
+
+class JobType(object):
+    def __init__(self, name, func, concurrency=1, nice=0, idle_io=False):
+        self.name = name
+        self.func = func
+        self.concurrency = concurrency
+        self.nice = nice
+        self.idle_io = idle_io
+
+
+class JobContext(object):
+    """ Handed to every job function to report progress and to check for
+    cancellation.
+    """
+
+    def __init__(self, scheduler, jobid):
+        self.scheduler = scheduler
+        self.jobid = jobid
+        self._last_log = 0
+
+    def progress(self, done, total=None, message=None):
+        """ Reports progress, either as fraction or as done of total """
+        fraction = float(done) / total if total else float(done)
+        self.scheduler._progress[self.jobid] = (fraction, message)
+        if time.time() - self._last_log > PROGRESS_LOG_INTERVAL:
+            self._last_log = time.time()
+            logger.info(u"Job %d: %d%% %s" % (self.jobid, fraction * 100,
+                                              message or u''))
+
+    def check(self):
+        """ Raises JobCancelled if the job has been cancelled. Jobs should
+        call this regularly.
+        """
+        if self.jobid in self.scheduler._cancelled:
+            raise JobCancelled()
+
+
+def in_offpeak_hours(now=None):
+    (start, end) = config.offpeak_hours
+    hour = (now or datetime.now()).hour
+    if start <= end:
+        return start <= hour < end
+    # Windows spanning midnight, like (22, 6)
+    return hour >= start or hour < end
+
+
+def lower_priority(nice=0, idle_io=False):
+    """ Lowers the CPU and/or I/O priority of the calling thread, so that
+    background jobs don't starve playback.
+    """
+    if nice:
+        # On Linux, nice() only affects the calling thread
+        try:
+            os.nice(nice)
+        except (AttributeError, OSError) as e:
+            logger.debug(u"Could not renice job thread: %s" % e)
+    if idle_io:
+        syscall = IOPRIO_SYSCALLS.get(platform.machine())
+        if platform.system() != 'Linux' or syscall is None:
+            return
+        # A 'who' of 0 means the calling thread
+        prio = IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT
+        if ctypes.CDLL(None).syscall(syscall, IOPRIO_WHO_PROCESS, 0, prio):
+            logger.debug(u"Could not set idle I/O priority for job thread")
+
+
+class Scheduler(object):
+    """ Runs ScheduledJobs in background threads, highest priority first,
+    with a concurrency limit per job type and for all jobs.
+    """
+
+    def __init__(self, max_workers=2, poll_interval=30):
+        self.types = {}
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self._running = {}
+        self._progress = {}
+        self._cancelled = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def register(self, name, func, concurrency=1, nice=0, idle_io=False):
+        """ Registers func(context, **params) as handler for jobs of type
+        name.
+        """
+        self.types[name] = JobType(name, func, concurrency, nice, idle_io)
+
+    def enqueue(self, jobtype, params=None, priority=0, delay=0,
+                interval=None, offpeak=False):
+        """ Adds a job to the queue and returns its id """
+        if jobtype not in self.types:
+            raise ValueError("Unknown job type '%s'!" % jobtype)
+        now = datetime.now()
+        job = ScheduledJob(type=jobtype, params=dumps(params or {}),
+                           priority=priority, interval=interval,
+                           offpeak=offpeak, created=now,
+                           run_after=now + timedelta(seconds=delay))
+        db_session.add(job)
+        db_session.commit()
+        self._wake.set()
+        return job.id
+
+    def cancel(self, jobid):
+        """ Cancels a queued job right away and asks a running job to
+        stop. Returns False if the job was already finished.
+        """
+        job = ScheduledJob.query.populate_existing().get(jobid)
+        if not job or job.status not in ('queued', 'running'):
+            return False
+        if job.status == 'queued':
+            job.status = 'cancelled'
+            job.finished = datetime.now()
+            db_session.commit()
+        else:
+            self._cancelled.add(job.id)
+        return True
+
+    def status(self, jobid):
+        # The job is updated by other threads, don't trust the session
+        job = ScheduledJob.query.populate_existing().get(jobid)
+        if not job:
+            return None
+        return self._job_dict(job)
+
+    def jobs(self, *statuses):
+        query = ScheduledJob.query.populate_existing()
+        if statuses:
+            query = query.filter(ScheduledJob.status.in_(statuses))
+        return [self._job_dict(job) for job in
+                query.order_by(ScheduledJob.id.desc())]
+
+    def _job_dict(self, job):
+        info = job.get_infodict()
+        # Progress of running jobs only lives in memory, to keep the
+        # database free for the job itself
+        if job.id in self._progress:
+            (info['progress'], info['message']) = self._progress[job.id]
+        return info
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop,
+                                        name='kinoknecht-scheduler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+
+    def _loop(self):
+        self._recover()
+        self._ensure_recurring()
+        while not self._stop.is_set():
+            try:
+                self._dispatch()
+            except Exception:
+                logger.error(u"Scheduling failed:\n%s"
+                             % traceback.format_exc())
+                db_session.rollback()
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+        db_session.remove()
+
+    def _recover(self):
+        """ Re-queues jobs that were running when the process died """
+        for job in ScheduledJob.search(ScheduledJob.status == 'running'):
+            logger.warning(u"Re-queueing interrupted job %d" % job.id)
+            job.status = 'queued'
+        db_session.commit()
+
+    def _ensure_recurring(self):
+        """ Makes sure the recurring jobs from the config are queued """
+        for (jobtype, interval) in config.recurring_jobs:
+            if not ScheduledJob.search(
+                    ScheduledJob.type == jobtype,
+                    ScheduledJob.interval != None,
+                    ScheduledJob.status.in_(('queued', 'running'))).count():
+                self.enqueue(jobtype, interval=interval, offpeak=True)
+
+    def _dispatch(self):
+        now = datetime.now()
+        offpeak = in_offpeak_hours(now)
+        candidates = ScheduledJob.search(
+            ScheduledJob.status == 'queued',
+            ScheduledJob.run_after <= now
+        ).order_by(ScheduledJob.priority.desc(), ScheduledJob.id).all()
+        for job in candidates:
+            with self._lock:
+                if len(self._running) >= self.max_workers:
+                    break
+                jobtype = self.types.get(job.type)
+                if jobtype is None or (job.offpeak and not offpeak):
+                    continue
+                if (self._running.values().count(job.type)
+                        >= jobtype.concurrency):
+                    continue
+                self._running[job.id] = job.type
+            job.status = 'running'
+            job.started = now
+            db_session.commit()
+            thread = threading.Thread(
+                target=self._run, args=(job.id, jobtype,
+                                        json.loads(job.params or '{}')),
+                name='kinoknecht-job-%d' % job.id)
+            thread.daemon = True
+            thread.start()
+
+    def _run(self, jobid, jobtype, params):
+        lower_priority(jobtype.nice, jobtype.idle_io)
+        context = JobContext(self, jobid)
+        status, error = 'done', None
+        try:
+            # JSON object keys are unicode, but keyword arguments can't be
+            jobtype.func(context, **dict((str(k), v)
+                                         for (k, v) in params.items()))
+        except JobCancelled:
+            status = 'cancelled'
+        except Exception:
+            status, error = 'failed', traceback.format_exc()
+            logger.error(u"Job %d (%s) failed:\n%s"
+                         % (jobid, jobtype.name, error))
+        try:
+            db_session.rollback()
+            job = ScheduledJob.get(jobid)
+            job.status = status
+            job.error = error and unicode(error, errors='replace')
+            job.progress = 1.0 if status == 'done' else \
+                self._progress.get(jobid, (0.0, None))[0]
+            job.finished = datetime.now()
+            if job.interval and status != 'cancelled':
+                self.enqueue(job.type, json.loads(job.params),
+                             job.priority, job.interval, job.interval,
+                             job.offpeak)
+            db_session.commit()
+        finally:
+            with self._lock:
+                del self._running[jobid]
+            self._progress.pop(jobid, None)
+            self._cancelled.discard(jobid)
+            db_session.remove()
+            self._wake.set()
+
+
+scheduler = Scheduler(config.scheduler_workers)
+
+
+def scan_job(context, paths=None):
+    """ Scans the given (or all configured) video directories """
+    paths = paths or Videofile.videodirs
+    for (idx, path) in enumerate(paths):
+        context.check()
+        context.progress(idx, len(paths), u"Scanning %s" % path)
+
+        def on_chunk(added):
+            # A cancelled scan resumes from its last chunk next time
+            context.check()
+            context.progress(idx, len(paths), u"Scanning %s, %d new files"
+                                              % (path, added))
+        Videofile.update_files(path, on_chunk=on_chunk)
+
+
+def metadata_job(context, category, id):
+    """ Refreshes the IMDb metadata of a single object """
+    obj = CATEGORIES_CLASSES[category].get(id)
+    obj.update_metadata()
+    db_session.commit()
+    response_cache.bump()
+    if obj.cover_url:
+        scheduler.enqueue('covers', {'urls': [obj.cover_url]})
+
+
+def enrich_show_job(context, showid):
+    """ Fetches the metadata of all episodes of a show that don't have any
+    yet.
+    """
+    episodes = [epi for epi in Show.get(showid).episodes if not epi.imdb_id]
+    for (idx, epi) in enumerate(episodes):
+        context.check()
+        context.progress(idx, len(episodes),
+                         u"Season %s, episode %s" % (epi.season_num,
+                                                     epi.episode_num))
+        epi.get_meta_from_show()
+        db_session.commit()
+    response_cache.bump()
+    if episodes:
+        scheduler.enqueue('covers')
+
+
+def covers_job(context, urls=None):
+    """ Downloads the given covers, or all that aren't cached yet """
+    urls = urls or images.missing_covers()
+    for (idx, url) in enumerate(urls):
+        context.check()
+        context.progress(idx, len(urls), url)
+        images.fetch_cover(url)
+    if urls:
+        # Pages rendered before show no cover yet
+        response_cache.bump()
+
+
+scheduler.register('scan', scan_job, concurrency=1, nice=10, idle_io=True)
+scheduler.register('metadata', metadata_job, concurrency=2, nice=5)
+scheduler.register('enrich_show', enrich_show_job, concurrency=1, nice=5)
+scheduler.register('covers', covers_job, concurrency=1, nice=10)
@@ -0,0 +1,119 @@
+from __future__ import absolute_import
+
+from datetime import date, datetime
+
+# simplejson ships with C speedups for older Pythons, fall back to the
+# standard library if it's not available.
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from sqlalchemy.orm import class_mapper
+from sqlalchemy.orm.properties import SynonymProperty
+
+from kinoknecht.database import db_session
+
+
+def _encode_default(obj):
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError("%r is not JSON serializable" % obj)
+
+_encoder = json.JSONEncoder(default=_encode_default, separators=(',', ':'))
+
+
+def dumps(obj):
+    """ Compact JSON representation of obj, with support for dates. """
+    return _encoder.encode(obj)
+
+
+def parse_datetime(value):
+    """ Parses a datetime written by dumps(), None is passed through. """
+    if value is None:
+        return None
+    if '.' in value:
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f')
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
+
+
+def parse_date(value):
+    """ Parses a date written by dumps(), None is passed through. """
+    if value is None:
+        return None
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+class Schema(object):
+    """ Precomputed field list for a model class, used to serialize its
+    instances without poking around in their __dict__.
+
+    The public fields are the table columns, named like the columns
+    themselves (so the '_imdb_id' attribute is exposed as 'imdb_id').
+    Public synonyms (like Videofile.title) can be requested explicitly.
+    """
+
+    def __init__(self, cls):
+        self.cls = cls
+        mapper = class_mapper(cls)
+        self.fields = [(column.name, mapper.get_property_by_column(column).key)
+                       for column in cls.__table__.columns]
+        self.names = tuple(name for (name, attr) in self.fields)
+        self._attrs = dict(self.fields)
+        for prop in mapper.iterate_properties:
+            if (isinstance(prop, SynonymProperty)
+                    and not prop.key.startswith('_')
+                    and prop.key not in self._attrs):
+                self._attrs[prop.key] = prop.name
+
+    def _resolve(self, keys):
+        if not keys:
+            return self.fields
+        # Unknown keys raise a KeyError, just like get_infodict always did
+        return [(k, self._attrs[k]) for k in keys]
+
+    def dump(self, obj, *keys):
+        """ Returns a dictionary with the values of obj for all specified
+        keys, or all public fields if no keys are specified.
+        """
+        return dict((name, getattr(obj, attr))
+                    for (name, attr) in self._resolve(keys))
+
+    def query(self, *keys):
+        """ Returns a query that only selects the columns for keys, skipping
+        the hydration of full ORM objects.
+        """
+        return db_session.query(*[getattr(self.cls, attr)
+                                  for (name, attr) in self._resolve(keys)])
+
+    def iter_rows(self, query, *keys, **kwargs):
+        """ Yields one dictionary per row of a query created by query(). """
+        names = [name for (name, attr) in self._resolve(keys)]
+        for row in query.yield_per(kwargs.get('chunk_size', 1000)):
+            yield dict(zip(names, row))
+
+    def iter_ndjson(self, query, *keys, **kwargs):
+        """ Yields the rows of query as newline-delimited JSON. """
+        for row in self.iter_rows(query, *keys, **kwargs):
+            yield dumps(row) + '\n'
+
+    def stream(self, fileobj, query, *keys, **kwargs):
+        """ Writes the rows of query to fileobj as newline-delimited JSON,
+        without building the result set in memory. Returns the row count.
+        """
+        count = 0
+        for line in self.iter_ndjson(query, *keys, **kwargs):
+            fileobj.write(line)
+            count += 1
+        return count
+
+
+_schemas = {}
+
+
+def schema_for(cls):
+    """ Returns the (cached) Schema for a model class. """
+    try:
+        return _schemas[cls]
+    except KeyError:
+        return _schemas.setdefault(cls, Schema(cls))
@@ -0,0 +1,147 @@
+from __future__ import absolute_import
+
+import logging
+import threading
+from SocketServer import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+from simpleapi import Route
+
+from kinoknecht import availability, config, workers
+from kinoknecht.database import db_session
+from kinoknecht.kinoweb import kinowebapp
+from kinoknecht.scheduler import scheduler
+
+logger = logging.getLogger("kinoknecht.server")
+
+# Requests below these prefixes are handled right away in the request
+# thread, everything else is handed to the 'db' worker pool. Media files
+# are too large to be buffered by the pool, images and static files
+# don't need the database.
+DIRECT_PREFIXES = ('/api/player', '/images', '/media', '/metrics',
+                   '/static')
+# Streamed exports are sent while they are produced, so they can't be
+# consumed by the pool either. They run in the request thread, at most
+# config.max_streams at once.
+STREAM_PREFIXES = ('/stream',)
+
+
+class ThreadedWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class _StreamResponse(object):
+    """ Response iterable that calls release once the server is done with
+    the response.
+    """
+
+    def __init__(self, iterable, release):
+        self.iterable = iterable
+        self.release = release
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            self.release()
+
+
+class PoolDispatcher(object):
+    """ WSGI middleware that runs requests in a worker pool, so that slow
+    database work can't occupy more than a fixed number of threads and
+    cheap requests like player commands are never stuck behind it.
+    """
+
+    def __init__(self, app, poolname, direct_prefixes=DIRECT_PREFIXES,
+                 stream_prefixes=STREAM_PREFIXES, max_streams=None):
+        self.app = app
+        self.poolname = poolname
+        self.direct_prefixes = direct_prefixes
+        self.stream_prefixes = stream_prefixes
+        self._streams = threading.BoundedSemaphore(
+            max_streams or config.max_streams)
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path.startswith(self.direct_prefixes):
+            return self.app(environ, start_response)
+        if path.startswith(self.stream_prefixes):
+            return self._stream(environ, start_response)
+        try:
+            # Consume the response in the worker, it might still touch the
+            # database while being iterated
+            return workers.call(self.poolname,
+                                lambda: list(self.app(environ,
+                                                      start_response)))
+        except workers.PoolFull:
+            return self._busy(start_response)
+
+    def _busy(self, start_response):
+        start_response('503 Service Unavailable',
+                       [('Content-Type', 'text/plain'),
+                        ('Retry-After', '5')])
+        return ['Server is busy, please try again later.']
+
+    def _stream(self, environ, start_response):
+        if not self._streams.acquire(False):
+            return self._busy(start_response)
+
+        def release():
+            # The response was produced in this thread, like in a worker
+            db_session.remove()
+            self._streams.release()
+        try:
+            return _StreamResponse(self.app(environ, start_response), release)
+        except:
+            release()
+            raise
+
+
+def register_api(app):
+    """ Publishes DBApi and PlayerApi on the Flask application """
+    # Imported here, as importing the API starts the player, which isn't
+    # wanted for scan agents serving files through this module
+    from kinoknecht.api import DBApi, PlayerApi
+    app.add_url_rule('/api/db/', 'api_db',
+                     Route(DBApi, framework='flask'),
+                     methods=['GET', 'POST'])
+    app.add_url_rule('/api/player/', 'api_player',
+                     Route(PlayerApi, framework='flask'),
+                     methods=['GET', 'POST'])
+
+
+def create_server(host=None, port=None):
+    """ Creates the threaded production server for the web interface and
+    the JSON-RPC APIs.
+    """
+    if config.db_address.startswith('sqlite:///:memory:'):
+        # Every thread would get its own empty in-memory database
+        logger.warning(u"The in-memory database can't be shared between "
+                       u"threads, please configure a database file!")
+    if 'api_db' not in kinowebapp.view_functions:
+        register_api(kinowebapp)
+    return make_server(host or config.server_host,
+                       port if port is not None else config.server_port,
+                       PoolDispatcher(kinowebapp, 'db'),
+                       server_class=ThreadedWSGIServer,
+                       handler_class=QuietRequestHandler)
+
+
+def serve(host=None, port=None):
+    server = create_server(host, port)
+    availability.monitor.start(config.storage_probe_interval)
+    scheduler.start()
+    logger.info(u"Serving on %s:%d" % server.server_address)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,305 @@
+from __future__ import absolute_import
+
+import heapq
+import logging
+import math
+import re
+import threading
+import traceback
+
+from sqlalchemy import func
+
+from kinoknecht.cache import response_cache
+from kinoknecht.database import db_session
+from kinoknecht.models import Movie, Episode, Show, Videofile
+from kinoknecht.serializers import json
+
+# NumPy makes lookups in large libraries a lot faster, but isn't required
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger("kinoknecht.similarity")
+
+# Relative weights of the feature groups in the similarity
+GENRE_WEIGHT = 1.0
+YEAR_WEIGHT = 0.6
+RATING_WEIGHT = 0.4
+RUNTIME_WEIGHT = 0.3
+PLAYED_WEIGHT = 0.2
+# Numeric features are scaled by fixed ranges rather than by the library's
+# statistics, so rows never have to be recomputed because of other rows
+YEAR_RANGE = (1900, 2030)
+MAX_RUNTIME = 240.0
+MAX_PLAYED = 50
+
+CATEGORIES = {'movie': Movie, 'episode': Episode, 'show': Show}
+NUMERIC_FEATURES = 4
+INITIAL_CAPACITY = 64
+DIGITS_REXP = re.compile(r'\d+')
+
+
+def parse_list(value):
+    """ Returns the strings in a list-valued metadata field. These are
+    stored as JSON, lists are even encoded twice (see
+    helpers.imdbcontainer_to_json).
+    """
+    while isinstance(value, basestring):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return [value]
+    return [x for x in value or [] if isinstance(x, basestring)]
+
+
+def parse_runtime(value):
+    """ Returns the runtime in minutes from the runtimes metadata field,
+    like '["90"]' or '["USA:90"]', or None.
+    """
+    for entry in parse_list(value):
+        numbers = DIGITS_REXP.findall(entry.split(':')[-1])
+        if numbers:
+            return int(numbers[0])
+    return None
+
+
+def parse_year(value):
+    """ Returns the (first) year of a year or a range like '2005-2010' """
+    if value is None or isinstance(value, int):
+        return value
+    numbers = DIGITS_REXP.findall(value)
+    return int(numbers[0]) if numbers else None
+
+
+def _scale(value, low, high):
+    return min(max((value - low) / float(high - low), 0.0), 1.0)
+
+
+class SimilarityIndex(object):
+    """ Feature matrix over all titles of a category, answering "more like
+    this" queries by cosine similarity.
+
+    Every title is a row of numeric features (year, rating, runtime, play
+    count) followed by one column per genre. Rows are weighted and
+    normalized to unit length when they are set, so the similarity of one
+    title to all others is a single matrix-vector product. Rows can be
+    updated individually, which keeps rebuilds after metadata changes
+    incremental, and the rows of removed titles are reused for new ones.
+    """
+
+    def __init__(self):
+        self.genres = {}
+        self._ids = []
+        self._rows = {}
+        self._free = []
+        self._sources = {}
+        self._lock = threading.Lock()
+        if numpy is not None:
+            self._matrix = numpy.zeros((INITIAL_CAPACITY, NUMERIC_FEATURES))
+        else:
+            self._matrix = []
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _vector(self, genres, year, rating, runtime, played):
+        for genre in genres:
+            if genre not in self.genres:
+                self._add_genre(genre)
+        width = NUMERIC_FEATURES + len(self.genres)
+        vector = [0.0] * width
+        if year:
+            vector[0] = YEAR_WEIGHT * _scale(year, *YEAR_RANGE)
+        if rating:
+            vector[1] = RATING_WEIGHT * _scale(rating, 0, 10)
+        if runtime:
+            vector[2] = RUNTIME_WEIGHT * _scale(runtime, 0, MAX_RUNTIME)
+        if played:
+            vector[3] = PLAYED_WEIGHT * _scale(math.log1p(played), 0,
+                                               math.log1p(MAX_PLAYED))
+        for genre in genres:
+            vector[NUMERIC_FEATURES + self.genres[genre]] = GENRE_WEIGHT
+        norm = math.sqrt(sum(x * x for x in vector))
+        return [x / norm for x in vector] if norm else vector
+
+    def _add_genre(self, genre):
+        self.genres[genre] = len(self.genres)
+        if numpy is not None:
+            self._matrix = numpy.hstack(
+                [self._matrix, numpy.zeros((self._matrix.shape[0], 1))])
+        else:
+            for row in self._matrix:
+                row.append(0.0)
+
+    def set(self, id, genres=(), year=None, rating=None, runtime=None,
+            played=None):
+        """ Sets the features of the title with id """
+        with self._lock:
+            vector = self._vector(genres, year, rating, runtime, played)
+            row = self._rows.get(id)
+            if row is None and self._free:
+                row = self._rows[id] = self._free.pop()
+                self._ids[row] = id
+            elif row is None:
+                row = self._rows[id] = len(self._ids)
+                self._ids.append(id)
+                if numpy is not None:
+                    if row >= self._matrix.shape[0]:
+                        # Grow geometrically to keep insertions cheap
+                        self._matrix = numpy.vstack(
+                            [self._matrix, numpy.zeros(self._matrix.shape)])
+                else:
+                    self._matrix.append(None)
+            self._matrix[row] = vector
+
+    def remove(self, id):
+        with self._lock:
+            row = self._rows.pop(id, None)
+            if row is None:
+                return
+            # The row stays until a new title takes it, but can't match
+            # anything anymore
+            self._ids[row] = None
+            self._free.append(row)
+            if numpy is not None:
+                self._matrix[row] = 0.0
+            else:
+                self._matrix[row] = [0.0] * len(self._matrix[row])
+
+    def similar(self, id, limit=5):
+        """ Returns up to limit (id, score) tuples for the titles most
+        similar to the one with id, best match first.
+        """
+        with self._lock:
+            row = self._rows.get(id)
+            if row is None:
+                return []
+            count = len(self._ids)
+            if numpy is not None:
+                matrix = self._matrix[:count]
+                scores = matrix.dot(matrix[row])
+                scores[row] = -1.0
+                limit = min(limit, count - 1)
+                if limit <= 0:
+                    return []
+                top = numpy.argpartition(-scores, limit - 1)[:limit]
+                top = top[numpy.argsort(-scores[top])]
+                ranked = [(idx, scores[idx]) for idx in top]
+            else:
+                vector = self._matrix[row]
+                ranked = heapq.nlargest(limit, (
+                    (idx, sum(a * b for (a, b) in zip(vector, other)))
+                    for (idx, other) in enumerate(self._matrix)
+                    if idx != row), key=lambda x: x[1])
+        return [(self._ids[idx], float(score)) for (idx, score) in ranked
+                if score > 0 and self._ids[idx] is not None]
+
+    def refresh(self, rows):
+        """ Updates the index from (id, genres, rating, year, runtimes,
+        played, length) rows, as returned by _feature_query. Only titles
+        whose metadata changed are recomputed, titles that are missing from
+        rows are removed. Returns the number of changed titles.
+        """
+        changed = 0
+        seen = set()
+        for source in rows:
+            source = tuple(source)
+            id = source[0]
+            seen.add(id)
+            if self._sources.get(id) == source:
+                continue
+            (genres, rating, year, runtimes, played, length) = source[1:]
+            runtime = parse_runtime(runtimes)
+            if runtime is None and length:
+                runtime = length / 60.0
+            self.set(id, [g.lower() for g in parse_list(genres)],
+                     parse_year(year), rating, runtime, played)
+            self._sources[id] = source
+            changed += 1
+        for id in [id for id in self._rows if id not in seen]:
+            self.remove(id)
+            del self._sources[id]
+            changed += 1
+        return changed
+
+
+def _feature_query(category):
+    """ Returns a query with one row of feature sources per title of
+    category, see SimilarityIndex.refresh.
+    """
+    if category not in CATEGORIES:
+        raise ValueError("Invalid category!")
+    cls = CATEGORIES[category]
+    year = Show.years if cls is Show else cls.year
+    query = db_session.query(
+        cls.id, cls.imdb_genres, cls.imdb_rating, year, cls.runtimes,
+        func.sum(Videofile.num_played), func.sum(Videofile.length))
+    if cls is Show:
+        query = query.outerjoin(Show.episodes, Episode.videofiles)
+    else:
+        query = query.outerjoin(cls.videofiles)
+    return query.group_by(cls.id)
+
+
+# Indexes per category, together with the library generation they were
+# last refreshed for
+_indexes = {}
+# Background refreshes in progress, per category
+_refreshing = {}
+_indexes_lock = threading.Lock()
+_build_lock = threading.Lock()
+
+
+def _refresh(category, index, generation):
+    changed = index.refresh(_feature_query(category))
+    with _indexes_lock:
+        _indexes[category] = (generation, index)
+    logger.debug(u"Updated %d of %d %s features"
+                 % (changed, len(index), category))
+
+
+def _refresh_in_background(category, index, generation):
+    try:
+        _refresh(category, index, generation)
+    except Exception:
+        logger.error(u"Could not refresh the %s features:\n%s"
+                     % (category, traceback.format_exc()))
+    finally:
+        db_session.remove()
+        with _indexes_lock:
+            _refreshing.pop(category, None)
+
+
+def get_index(category):
+    """ Returns the SimilarityIndex of category. It is built on first use,
+    later library changes are applied by a background thread while the
+    index keeps answering with the previous features.
+    """
+    generation = response_cache.generation
+    with _indexes_lock:
+        (refreshed, index) = _indexes.get(category, (None, None))
+        if index is not None:
+            if refreshed != generation and category not in _refreshing:
+                thread = threading.Thread(
+                    target=_refresh_in_background,
+                    args=(category, index, generation),
+                    name='kinoknecht-similarity')
+                thread.daemon = True
+                _refreshing[category] = thread
+                thread.start()
+            return index
+    # There's nothing to answer with before the first build
+    with _build_lock:
+        if category not in _indexes:
+            _refresh(category, SimilarityIndex(), generation)
+    return _indexes[category][1]
+
+
+def more_like_this(category, id, limit=5):
+    """ Returns up to limit objects of category most similar to the one
+    with id, best match first.
+    """
+    ranked = get_index(category).similar(int(id), limit)
+    objs = CATEGORIES[category].get_many(x[0] for x in ranked)
+    return [objs[x[0]] for x in ranked if x[0] in objs]
@@ -0,0 +1,121 @@
+from __future__ import absolute_import
+
+import itertools
+import logging
+import threading
+import time
+import traceback
+from Queue import Queue, Full
+
+from kinoknecht import config
+from kinoknecht.database import db_session
+
+logger = logging.getLogger("kinoknecht.workers")
+
+
+class PoolFull(Exception):
+    """ Raised when a job is submitted to a pool whose queue is full """
+
+
+class Job(object):
+    """ A unit of work running in a WorkerPool """
+    _ids = itertools.count(1)
+
+    def __init__(self, name, func, args=(), kwargs=None):
+        self.id = next(self._ids)
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = self.finished = None
+        self._done = threading.Event()
+
+    def run(self):
+        self.status = 'running'
+        self.started = time.time()
+        try:
+            self.result = self.func(*self.args, **self.kwargs)
+            self.status = 'done'
+        except Exception as e:
+            logger.error(u"Job %d (%s) failed:\n%s"
+                         % (self.id, self.name, traceback.format_exc()))
+            self.error = e
+            self.status = 'failed'
+        finally:
+            self.finished = time.time()
+            self._done.set()
+
+    def wait(self, timeout=None):
+        """ Waits for the job to finish and returns its result, re-raising
+        any exception raised by the job.
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError("Job %d did not finish in time" % self.id)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def as_dict(self):
+        return dict(id=self.id, name=self.name, status=self.status,
+                    error=unicode(self.error) if self.error else None,
+                    created=self.created, started=self.started,
+                    finished=self.finished)
+
+
+class WorkerPool(object):
+    """ A fixed number of worker threads processing jobs from a bounded
+    queue, so blocking work can't pile up without limit.
+    """
+
+    def __init__(self, name, size, maxqueue=100):
+        self.name = name
+        self.size = size
+        self._queue = Queue(maxqueue)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for idx in range(self.size):
+                thread = threading.Thread(target=self._work,
+                                          name='%s-%d' % (self.name, idx))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                job.run()
+            finally:
+                # Every worker thread has its own session, don't keep
+                # objects from the last job around
+                db_session.remove()
+                self._queue.task_done()
+
+    def submit(self, job):
+        self._start()
+        try:
+            self._queue.put_nowait(job)
+        except Full:
+            raise PoolFull("Too many pending jobs in pool '%s'" % self.name)
+        return job
+
+
+pools = dict((name, WorkerPool(name, size))
+             for (name, size) in config.worker_pools.items())
+
+
+def call(poolname, func, *args, **kwargs):
+    """ Runs func in the given pool and waits for its result, which bounds
+    the number of concurrent calls to the size of the pool.
+    """
+    return pools[poolname].submit(Job(func.__name__, func, args,
+                                      kwargs)).wait()
@@ -0,0 +1,103 @@
+import os
+from os.path import join
+
+from simpleapi import DummyClient, Route
+
+from test_model import (create_dummy_env, remove_dummy_env, TESTDIR,
+                        TESTMOV, TESTCD1)
+from kinoknecht import config
+from kinoknecht.agent import (ScanAgent, FileServer, UnsatisfiableRange,
+                              _parse_range)
+from kinoknecht.api import DBApi
+from kinoknecht.database import init_db, shutdown_db
+from kinoknecht.models import Videofile
+
+client = DummyClient(Route(DBApi, framework='dummy'))
+
+
+class TestAgent(object):
+    def setUp(self):
+        create_dummy_env()
+        init_db()
+        config.nodes = {'nas': 'http://nas:5001'}
+        self.agent = ScanAgent(client, node='nas', batch_size=2)
+
+    def tearDown(self):
+        config.nodes = {}
+        remove_dummy_env()
+        shutdown_db()
+
+    def testScan(self):
+        assert self.agent.scan() == {'added': 5, 'removed': 0}
+        assert Videofile.search(Videofile.node == u'nas').count() == 5
+        assert self.agent.scan() == {'added': 0, 'removed': 0}
+
+    def testRemoved(self):
+        self.agent.scan()
+        os.remove(join(TESTDIR, TESTMOV))
+        assert self.agent.scan() == {'added': 0, 'removed': 1}
+
+    def testUnmounted(self):
+        self.agent.scan()
+        os.rename(TESTDIR, TESTDIR + '.away')
+        try:
+            assert self.agent.scan() == {'added': 0, 'removed': 0}
+        finally:
+            os.rename(TESTDIR + '.away', TESTDIR)
+        assert Videofile.search(Videofile.node == u'nas').count() == 5
+
+    def testUnknownNode(self):
+        assert ScanAgent(client, node='attic').known_files() == {}
+        assert client.ingest_batch(node='attic', added=[]) == "Unknown node!"
+
+    def testRemoteFile(self):
+        self.agent.scan()
+        vfile = Videofile.search(Videofile.name == TESTCD1).one()
+        assert vfile.location() == ('http://nas:5001/files%s/Spam%%20and'
+                                    '%%20Eggs%%20CD1.avi'
+                                    % os.path.abspath(TESTDIR))
+        assert vfile.subfilepath and vfile.subtitles
+
+    def testBrowseNode(self):
+        self.agent.scan()
+        assert Videofile.browse(node='nas') == [[os.path.abspath(TESTDIR)],
+                                                []]
+
+    def testFileServer(self):
+        server = FileServer([TESTDIR])
+        path = os.path.abspath(join(TESTDIR, TESTMOV))
+        size = os.path.getsize(path)
+        responses = []
+        start_response = lambda status, headers: responses.append(
+            (status, dict(headers)))
+        body = ''.join(server({'PATH_INFO': '/files' + path,
+                               'REQUEST_METHOD': 'GET',
+                               'HTTP_RANGE': 'bytes=10-19'}, start_response))
+        assert len(body) == 10
+        assert responses[0][0].startswith('206')
+        assert responses[0][1]['Content-Range'] == 'bytes 10-19/%d' % size
+        server({'PATH_INFO': '/files/etc/passwd', 'REQUEST_METHOD': 'GET'},
+               start_response)
+        assert responses[1][0].startswith('404')
+        server({'PATH_INFO': '/files' + path, 'REQUEST_METHOD': 'GET',
+                'HTTP_RANGE': 'bytes=%d-' % size}, start_response)
+        assert responses[2][0].startswith('416')
+        assert responses[2][1]['Content-Range'] == 'bytes */%d' % size
+
+    def testParseRange(self):
+        assert _parse_range('bytes=50-', 100) == (50, 99)
+        assert _parse_range('bytes=-10', 100) == (90, 99)
+        assert _parse_range('bytes=90-200', 100) == (90, 99)
+        assert _parse_range('bytes=a-b', 100) is None
+        assert _parse_range('bytes=0-1,5-6', 100) is None
+
+    def testUnsatisfiableRange(self):
+        for header in ('bytes=-0', 'bytes=100-', 'bytes=150-200'):
+            try:
+                _parse_range(header, 100)
+            except UnsatisfiableRange:
+                pass
+            else:
+                assert False, header
+        assert _parse_range('bytes=99-', 100) == (99, 99)
+        assert _parse_range('bytes=20-10', 100) is None
@@ -6,7 +6,7 @@ from simpleapi import DummyClient, Route
 
 from test_model import create_dummy_env, remove_dummy_env
 from kinoknecht.database import init_db, shutdown_db
-from kinoknecht.api import DBApi
+from kinoknecht.api import DBApi, NO_SCHEDULER
 
 client = DummyClient(Route(DBApi, framework='dummy'))
 
@@ -29,6 +29,50 @@ class TestApi(object):
         objid = client.create(category='show', title='Dummy')
         assert objid == 1
 
+    def testCreateMany(self):
+        results = client.create_many(items=[
+            {'category': 'show', 'title': 'Dummy'},
+            {'category': 'episode', 'vfiles': [4], 'title': 'Pilot'},
+            {'category': 'episode', 'vfiles': [42], 'title': 'Missing'},
+            {'category': 'show'}])
+        assert results[0] == {'id': 1} and results[1] == {'id': 1}
+        assert 'error' in results[2] and 'error' in results[3]
+
+    def testAssignMany(self):
+        client.create_many(items=[
+            {'category': 'show', 'title': 'Dummy'},
+            {'category': 'episode', 'vfiles': [4], 'title': 'Pilot'},
+            {'category': 'episode', 'vfiles': [5], 'title': 'Second'}])
+        results = client.assign_many(category='show',
+                                     assignments=[[1, [1, 2]], [2, [1]]])
+        assert results[0] == {'id': 1, 'assigned': 2}
+        assert 'error' in results[1]
+        assert client.add_to_show(showid=1, episodes=[2])
+
+    def testEpisodeConflicts(self):
+        client.create_many(items=[
+            {'category': 'episode', 'vfiles': [4], 'title': 'Pilot'}])
+        results = client.create_many(items=[
+            {'category': 'episode', 'vfiles': [4], 'title': 'Again'},
+            {'category': 'episode', 'vfiles': [5], 'title': 'Second'},
+            {'category': 'episode', 'vfiles': [5], 'title': 'Twice'}])
+        assert 'error' in results[0] and 'error' in results[2]
+        assert results[1] == {'id': 2}
+        results = client.assign_many(category='episode',
+                                     assignments=[[1, [5]], [1, [4]]])
+        assert 'error' in results[0]
+        assert results[1] == {'id': 1, 'assigned': 1}
+
+    def testJobsNeedScheduler(self):
+        # The scheduler only runs in the production server
+        assert client.schedule_job(jobtype='scan') == NO_SCHEDULER
+        assert client.update_database(background=True) == NO_SCHEDULER
+
+    def testDeleteMany(self):
+        results = client.delete_many(category='file', ids=[1, 2, 42])
+        assert results[0] == {'id': 1} and results[1] == {'id': 2}
+        assert 'error' in results[2]
+
     def testQuery(self):
         results = client.query(category='file', searchstr='spam')
         pprint(results)
@@ -0,0 +1,46 @@
+import os
+import threading
+
+from kinoknecht import config
+from kinoknecht.availability import AvailabilityMap, root_for
+
+
+def fail():
+    raise OSError("Host is down")
+
+
+class TestAvailability(object):
+    def setUp(self):
+        self.map = AvailabilityMap(timeout=0.1)
+        self.hang = threading.Event()
+
+    def tearDown(self):
+        self.hang.set()
+
+    def testUnknownIsOnline(self):
+        assert self.map.is_online('/srv/video')
+
+    def testProbe(self):
+        assert self.map.probe('/srv/video', lambda: None)
+        assert not self.map.probe('/srv/video', fail)
+        assert self.map.status()['/srv/video']['error'] == u"Host is down"
+        assert self.map.version == 1
+
+    def testTimeout(self):
+        assert not self.map.probe('/srv/video', self.hang.wait)
+        assert not self.map.is_online('/srv/video')
+        # The hanging probe isn't started again
+        assert not self.map.probe('/srv/video', lambda: None)
+        self.hang.set()
+
+    def testRootFor(self):
+        dirs = config.video_dirs
+        config.video_dirs = ['tests/testdir', 'tests/testdir/Movies']
+        try:
+            root = os.path.abspath('tests/testdir')
+            assert root_for(os.path.join(root, 'Show')) == root
+            assert root_for(os.path.join(root, 'Movies', 'Spam')) == \
+                   os.path.join(root, 'Movies')
+            assert root_for('/elsewhere') is None
+        finally:
+            config.video_dirs = dirs
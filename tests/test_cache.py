@@ -0,0 +1,30 @@
+from kinoknecht.cache import LRUCache, ResponseCache
+
+
+class TestCache(object):
+    def setUp(self):
+        self.backend = LRUCache(maxsize=3)
+        self.cache = ResponseCache(self.backend)
+
+    def testLRUEviction(self):
+        for i in range(3):
+            self.backend.set(i, str(i))
+        # Touch the oldest entry so that '1' becomes the eviction candidate
+        assert self.backend.get(0) == '0'
+        self.backend.set(3, '3')
+        assert self.backend.get(1) is None
+        assert self.backend.get(0) == '0' and len(self.backend) == 3
+
+    def testCacheHit(self):
+        key = self.cache.key('browse', 'file', 1)
+        self.cache.set(key, 'page')
+        assert self.cache.get(self.cache.key('browse', 'file', 1)) == 'page'
+        assert self.cache.get(self.cache.key('browse', 'file', 2)) is None
+
+    def testGenerationInvalidates(self):
+        oldkey = self.cache.key('details', 'movie', 1)
+        self.cache.set(oldkey, 'page')
+        self.cache.bump()
+        newkey = self.cache.key('details', 'movie', 1)
+        assert newkey != oldkey
+        assert self.cache.get(newkey) is None
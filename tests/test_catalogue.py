@@ -0,0 +1,64 @@
+from datetime import datetime
+from StringIO import StringIO
+
+from test_model import create_dummy_env, remove_dummy_env
+from kinoknecht.catalogue import export_catalogue, import_catalogue
+from kinoknecht.database import db_session, init_db, shutdown_db
+from kinoknecht.history import DailyHistory, HistoryWriter, TitleHistory
+from kinoknecht.models import Videofile, Movie
+
+
+class TestCatalogue(object):
+    def setUp(self):
+        create_dummy_env()
+        init_db()
+        Videofile.update_all()
+
+    def tearDown(self):
+        remove_dummy_env()
+        shutdown_db()
+
+    def testRoundtrip(self):
+        mov = Movie(videofiles=[Videofile.get(2), Videofile.get(3)])
+        mov.title = u'Spam and Eggs'
+        db_session.add(mov)
+        db_session.commit()
+        writer = HistoryWriter(batch_size=1000, flush_interval=3600)
+        writer.record('play', 1, 0, 100, timestamp=datetime(2011, 3, 1, 20))
+        writer.record('stop', position=50,
+                      timestamp=datetime(2011, 3, 1, 20, 1))
+        writer.flush()
+        expected = [v.get_infodict() for v in Videofile.search()]
+
+        dump = StringIO()
+        exported = export_catalogue(dump)
+        shutdown_db()
+        init_db()
+        dump.seek(0)
+        imported = import_catalogue(dump, chunk_size=2)
+
+        # 12 library rows, 2 playback events, a title and a day rollup
+        assert exported == imported == 16
+        assert [v.get_infodict() for v in Videofile.search()] == expected
+        assert len(Movie.get(1).videofiles) == 2
+        assert TitleHistory.query.one().watched_seconds == 60
+        assert DailyHistory.query.one().day == datetime(2011, 3, 1).date()
+
+    def testInvalidCatalogue(self):
+        try:
+            import_catalogue(StringIO('{"format": "spam"}\n'))
+        except ValueError:
+            return
+        assert False
+
+    def testMergeRefused(self):
+        dump = StringIO()
+        export_catalogue(dump)
+        dump.seek(0)
+        try:
+            import_catalogue(dump, replace=False)
+        except ValueError:
+            pass
+        else:
+            assert False
+        assert Videofile.query.count() > 0
@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+
+from test_model import create_dummy_env, remove_dummy_env
+from kinoknecht import history
+from kinoknecht.cache import response_cache
+from kinoknecht.database import init_db, shutdown_db
+from kinoknecht.history import (HistoryWriter, PlaybackEvent, TitleHistory,
+                                DailyHistory, continue_watching,
+                                recently_watched)
+from kinoknecht.models import Videofile
+
+START = datetime(2011, 3, 1, 20, 0)
+
+
+def at(minutes):
+    return START + timedelta(minutes=minutes)
+
+
+class TestHistory(object):
+    def setUp(self):
+        create_dummy_env()
+        init_db()
+        Videofile.update_all()
+        # Never flushes on its own during the tests
+        self.writer = HistoryWriter(batch_size=1000, flush_interval=3600)
+
+    def tearDown(self):
+        remove_dummy_env()
+        shutdown_db()
+
+    def testEventLog(self):
+        self.writer.record('play', 1, 0, 5400, timestamp=at(0))
+        self.writer.record('pause', position=600, timestamp=at(10))
+        self.writer.record('pause', position=600, timestamp=at(15))
+        self.writer.record('stop', position=900, timestamp=at(20))
+        assert self.writer.flush() == 4
+        events = PlaybackEvent.query.order_by(PlaybackEvent.id)
+        assert ([e.event for e in events]
+                == ['play', 'pause', 'resume', 'stop'])
+
+    def testRollups(self):
+        self.writer.record('play', 1, 0, 5400, timestamp=at(0))
+        self.writer.record('pause', position=600, timestamp=at(10))
+        self.writer.record('pause', position=600, timestamp=at(15))
+        self.writer.record('stop', position=900, timestamp=at(20))
+        self.writer.flush()
+        title = TitleHistory.query.one()
+        assert title.plays == 1 and title.completed == 0
+        assert title.watched_seconds == 900
+        assert title.last_position == 900 and not title.finished
+        assert Videofile.get(1).num_played == 1
+        assert Videofile.get(1).last_pos == 900
+        assert DailyHistory.query.one().watched_seconds == 900
+
+    def testFlushBumpsCache(self):
+        generation = response_cache.generation
+        self.writer.record('play', 1, 0, 5400, timestamp=at(0))
+        self.writer.flush()
+        assert response_cache.generation != generation
+
+    def testCompletion(self):
+        self.writer.record('play', 2, 0, 100, timestamp=at(0))
+        self.writer.record('stop', position=95, timestamp=at(2))
+        self.writer.record('play', 2, 0, 100, timestamp=at(3))
+        self.writer.flush()
+        self.writer.record('stop', position=10, timestamp=at(4))
+        self.writer.flush()
+        title = TitleHistory.query.one()
+        assert title.plays == 2 and title.completion_rate == 0.5
+        assert title.last_position == 10
+
+    def testViews(self):
+        self.writer.record('play', 1, 0, 5400, timestamp=at(0))
+        self.writer.record('stop', position=600, timestamp=at(10))
+        self.writer.record('play', 2, 0, 100, timestamp=at(11))
+        self.writer.record('stop', position=100, timestamp=at(13))
+        self.writer.flush()
+        assert [x.videofile_id for x in recently_watched()] == [2, 1]
+        assert [x.videofile_id for x in continue_watching()] == [1]
+
+    def testEventsWithoutPlayback(self):
+        self.writer.record('pause', position=10)
+        assert self.writer.flush() == 0
+
+    def testFailedFlushes(self):
+        self.writer.record('play', 1, 0, 5400, timestamp=at(0))
+        self.writer.record('stop', position=600, timestamp=at(10))
+        shutdown_db()
+        for attempt in range(history.MAX_FAILED_FLUSHES):
+            try:
+                self.writer.flush()
+            except Exception:
+                pass
+            else:
+                assert False
+        # The changes are dropped after the last attempt
+        init_db()
+        assert self.writer.flush() == 0
+
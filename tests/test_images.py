@@ -0,0 +1,135 @@
+import glob
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+
+from kinoknecht import config, images
+from kinoknecht.database import db_session, init_db, shutdown_db
+from kinoknecht.images import (CoverImage, cover_digests, fetch_cover,
+                               missing_covers, store_image, variant_path)
+from kinoknecht.models import Movie
+
+
+def png(width=4, height=6):
+    """ Returns a plain white PNG image """
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+    rows = ('\x00' + '\xff\xff\xff' * width) * height
+    return ('\x89PNG\r\n\x1a\n'
+            + chunk('IHDR', struct.pack('>IIBBBBB', width, height, 8, 2,
+                                        0, 0, 0))
+            + chunk('IDAT', zlib.compress(rows)) + chunk('IEND', ''))
+
+
+class TestImageStore(object):
+    def setUp(self):
+        self.image_dir = config.image_dir
+        self.image_sizes = config.image_sizes
+        config.image_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(config.image_dir)
+        config.image_dir = self.image_dir
+        config.image_sizes = self.image_sizes
+
+    def testStore(self):
+        digest = store_image(png())
+        for size in config.image_sizes:
+            path = variant_path(digest, size)
+            assert path and os.path.exists(path)
+            assert images.content_type(path).startswith('image/')
+        # The same content is only stored once
+        count = sum(len(files) for (_, _, files) in
+                    os.walk(config.image_dir))
+        assert store_image(png()) == digest
+        assert count == sum(len(files) for (_, _, files) in
+                            os.walk(config.image_dir))
+
+    def testTemporaryFilesAreNotServed(self):
+        digest = store_image(png())
+        path = variant_path(digest, 'thumb')
+        dirname = os.path.dirname(path)
+        for name in os.listdir(dirname):
+            os.remove(os.path.join(dirname, name))
+        # Left behind by an interrupted write
+        images._write(path, 'half')
+        os.rename(path, os.path.join(dirname, '.tmp-1-'
+                                     + os.path.basename(path)))
+        assert variant_path(digest, 'thumb') is None
+        # The missing variants are written again
+        assert store_image(png()) == digest
+        assert variant_path(digest, 'thumb')
+
+    def testNewSize(self):
+        digest = store_image(png())
+        config.image_sizes = dict(config.image_sizes, huge=(1000, 1480))
+        path = variant_path(digest, 'huge')
+        assert path and os.path.exists(path)
+        if images.Image is not None:
+            assert '-huge.' in path
+
+    def testNotAnImage(self):
+        try:
+            store_image('<html></html>')
+        except ValueError:
+            pass
+        else:
+            assert False
+
+    def testVariantPath(self):
+        digest = store_image(png())
+        assert variant_path(digest, 'huge') is None
+        assert variant_path('../../etc/passwd', 'thumb') is None
+        assert variant_path('0' * 40, 'thumb') is None
+
+
+class TestCovers(object):
+    def setUp(self):
+        init_db()
+        self.image_dir = config.image_dir
+        self.image_sizes = config.image_sizes
+        config.image_dir = tempfile.mkdtemp()
+        (fd, self.cover) = tempfile.mkstemp(suffix='.png')
+        os.write(fd, png())
+        os.close(fd)
+        self.url = 'file://' + self.cover
+        db_session.add(Movie(title=u'Spam', cover_url=self.url))
+        db_session.add(Movie(title=u'Eggs'))
+        db_session.commit()
+
+    def tearDown(self):
+        shutdown_db()
+        shutil.rmtree(config.image_dir)
+        config.image_dir = self.image_dir
+        config.image_sizes = self.image_sizes
+        os.remove(self.cover)
+
+    def testFetch(self):
+        assert missing_covers() == [self.url]
+        digest = fetch_cover(self.url)
+        assert digest and variant_path(digest, 'thumb')
+        assert missing_covers() == []
+        assert cover_digests(Movie.query.all()) == {self.url: digest}
+
+    def testFailedFetch(self):
+        url = 'file:///nonexistent/cover.jpg'
+        assert fetch_cover(url) is None
+        cover = CoverImage.query.filter_by(url=url).one()
+        assert cover.error and cover.digest is None
+
+    def testStoredWithoutOriginal(self):
+        digest = fetch_cover(self.url)
+        os.remove(variant_path(digest, 'thumb'))
+        for path in glob.glob(os.path.join(config.image_dir, digest[:2],
+                                           digest + '-orig.*')):
+            os.remove(path)
+        config.image_sizes = dict(config.image_sizes, huge=(1000, 1480))
+        if images.Image is not None:
+            # Nothing to create the new size from, so it's fetched again
+            assert missing_covers() == [self.url]
+            fetch_cover(self.url)
+            assert variant_path(digest, 'huge')
+        assert missing_covers() == []
@@ -0,0 +1,45 @@
+import time
+
+from kinoknecht.metrics import Registry, SamplingProfiler
+
+
+class TestMetrics(object):
+    def setUp(self):
+        self.registry = Registry()
+
+    def testCounter(self):
+        counter = self.registry.counter('spam_total', "Spam", ['kind'])
+        counter.labels('eggs').inc()
+        counter.labels('eggs').inc(2)
+        assert counter.labels('eggs').value == 3
+        assert 'spam_total{kind="eggs"} 3' in self.registry.render()
+
+    def testLabelEscaping(self):
+        counter = self.registry.counter('spam_total', "Spam", ['path'])
+        counter.labels('C:\\Movies\n"Spam"').inc()
+        assert ('spam_total{path="C:\\\\Movies\\n\\"Spam\\""} 1'
+                in self.registry.render())
+
+    def testSummary(self):
+        summary = self.registry.summary('spam_seconds', "Spam")
+        with summary.labels().time():
+            pass
+        summary.labels().observe(1.0)
+        output = self.registry.render()
+        assert '# TYPE spam_seconds summary' in output
+        assert 'spam_seconds_count 2' in output
+
+    def testInvalidLabels(self):
+        counter = self.registry.counter('spam_total', "Spam", ['kind'])
+        try:
+            counter.labels()
+        except ValueError:
+            return
+        assert False
+
+    def testProfiler(self):
+        profiler = SamplingProfiler()
+        profiler.start(interval=0.001)
+        time.sleep(0.05)
+        profiler.stop()
+        assert 'testProfiler' in profiler.render()
@@ -1,14 +1,18 @@
 import os
+import json
 import shutil
 from os.path import join
+from StringIO import StringIO
 
-from kinoknecht import config
+from kinoknecht import availability, config
 config.video_dirs = ['tests/testdir']
 config.log_file = 'tests/logdir/dummy.log'
 config.db_file = 'tests/dummy.db'
 
-from kinoknecht.database import init_db, shutdown_db
-from kinoknecht.models import Videofile, Movie
+from kinoknecht.database import db_session, init_db, shutdown_db
+from kinoknecht.models import (Videofile, Movie, ScanCheckpoint,
+                               _index_subtitles, _scanned_before, _walk_key)
+from kinoknecht.serializers import dumps
 
 TESTVIDSRC = 'tests/test.avi'
 TESTDIR = 'tests/testdir'
@@ -19,6 +23,10 @@ TESTCD2 = 'Spam and Eggs CD2.avi'
 TESTMOVSUB = 'Spam and Eggs CD1.srt'
 TESTEPI1 = 'How.I.Met.Your.Mother.S01E04.avi'
 TESTEPI2 = 'How.I.Met.Your.Mother.108.avi'
+TESTEPISUBS = ['How.I.Met.Your.Mother.108.en.srt',
+               'How.I.Met.Your.Mother.108.de.srt']
+TESTSUBDIR = join(TESTDIR, 'Subs')
+TESTCD2SUB = 'Spam and Eggs CD2.de.srt'
 
 def create_dummy_env():
     # Clean up if previous tests failed to do so
@@ -33,6 +41,10 @@ def create_dummy_env():
     open(join(TESTDIR, TESTMOVSUB), 'w').close()
     shutil.copyfile(TESTVIDSRC, join(TESTSHOW, TESTEPI1))
     shutil.copyfile(TESTVIDSRC, join(TESTSHOW, TESTEPI2))
+    for sub in TESTEPISUBS:
+        open(join(TESTSHOW, sub), 'w').close()
+    os.mkdir(TESTSUBDIR)
+    open(join(TESTSUBDIR, TESTCD2SUB), 'w').close()
 
 def remove_dummy_env():
     shutil.rmtree(TESTDIR)
@@ -52,6 +64,111 @@ class TestModel(object):
         assert (Videofile.search(Videofile.name == TESTCD1).one().subfilepath
                 == os.path.abspath(join(TESTDIR, TESTMOVSUB)))
 
+    def testLanguageSubtitles(self):
+        vfile = Videofile.search(Videofile.name == TESTEPI2).one()
+        assert (sorted(sub.language for sub in vfile.subtitles)
+                == [u'de', u'en'])
+
+    def testSubfolderSubtitles(self):
+        vfile = Videofile.search(Videofile.name == TESTCD2).one()
+        assert ([(sub.path, sub.language) for sub in vfile.subtitles]
+                == [(os.path.abspath(join(TESTSUBDIR, TESTCD2SUB)), u'de')])
+
+    def testSingleVideoSubfolder(self):
+        solodir = join(TESTDIR, 'Solo')
+        os.makedirs(join(solodir, 'Subs'))
+        shutil.copyfile(TESTVIDSRC, join(solodir, 'Solo.avi'))
+        open(join(solodir, 'Subs', 'Solo.en.srt'), 'w').close()
+        Videofile.update_all()
+        vfile = Videofile.search(Videofile.name == u'Solo.avi').one()
+        assert ([(sub.path, sub.language) for sub in vfile.subtitles]
+                == [(os.path.abspath(join(solodir, 'Subs', 'Solo.en.srt')),
+                     u'en')])
+
+    def testSubtitlesOfExistingFiles(self):
+        subpath = join(TESTDIR, 'The Meaning of Life.de.srt')
+        open(subpath, 'w').close()
+        Videofile.update_all()
+        vfile = Videofile.search(Videofile.name == TESTMOV).one()
+        assert ([(sub.path, sub.language) for sub in vfile.subtitles]
+                == [(os.path.abspath(subpath), u'de')])
+
+    def testSubtitleIndex(self):
+        index = _index_subtitles(['Movie.srt', 'Movie.en.srt',
+                                  'Subs/2_English.srt'], single_video=True)
+        assert index['Movie'] == [('Movie.srt', None), ('Movie.en.srt', 'en')]
+        assert index[None] == [('Subs/2_English.srt', 'english')]
+
+    def testSubtitleIndexLanguages(self):
+        index = _index_subtitles(['The Meaning of Life.srt',
+                                  'Movie.forced.srt', 'Movie.sdh.srt',
+                                  'Subs/Forced.srt'], single_video=True)
+        assert 'The Meaning of' not in index
+        assert index['The Meaning of Life'] == [
+            ('The Meaning of Life.srt', None)]
+        assert 'Movie' not in index
+        assert index['Movie.forced'] == [('Movie.forced.srt', None)]
+        assert index['Movie.sdh'] == [('Movie.sdh.srt', None)]
+        assert index[None] == [('Subs/Forced.srt', None)]
+
+    def _remove_videofiles(self):
+        for vfile in Videofile.query:
+            db_session.delete(vfile)
+        db_session.commit()
+
+    def testInterruptedScan(self):
+        self._remove_videofiles()
+
+        def abort(added):
+            raise KeyboardInterrupt()
+        try:
+            Videofile.update_files(TESTDIR, chunk_size=1, on_chunk=abort)
+        except KeyboardInterrupt:
+            pass
+        checkpoint = ScanCheckpoint.query.one()
+        assert checkpoint.last_dir == os.path.abspath(TESTDIR)
+        assert checkpoint.added == Videofile.query.count() == 3
+        # The resumed scan only looks at the remaining directories
+        Videofile.update_files(TESTDIR)
+        assert Videofile.query.count() == 5
+        assert ScanCheckpoint.query.count() == 0
+
+    def testChunksKeepCallerObjects(self):
+        vfile = Videofile.search(Videofile.name == TESTMOV).one()
+        movie = Movie(videofiles=[vfile])
+        db_session.add(movie)
+        db_session.commit()
+        shutil.copyfile(TESTVIDSRC, join(TESTSHOW, 'Spam.avi'))
+        shutil.copyfile(TESTVIDSRC, join(TESTDIR, 'Eggs.avi'))
+        Videofile.update_files(TESTDIR, chunk_size=1)
+        assert movie in db_session and vfile in db_session
+        movie.title = u'The Meaning of Life'
+        db_session.commit()
+        db_session.expunge_all()
+        assert Movie.get(movie.id).title == u'The Meaning of Life'
+
+    def testResumeSkipsScannedDirectories(self):
+        self._remove_videofiles()
+        db_session.add(ScanCheckpoint(unicode(os.path.abspath(TESTDIR))))
+        ScanCheckpoint.query.one().last_dir = unicode(
+            os.path.abspath(TESTSHOW))
+        db_session.commit()
+        Videofile.update_files(TESTDIR)
+        assert Videofile.query.count() == 0
+
+    def testSubdirectoryScanProbesRoot(self):
+        Videofile.update_files(TESTSHOW)
+        status = availability.monitor.status()
+        assert os.path.abspath(TESTDIR) in status
+        assert os.path.abspath(TESTSHOW) not in status
+
+    def testWalkOrder(self):
+        resume_key = _walk_key('/video/b/x')
+        assert _scanned_before(_walk_key('/video/a'), resume_key)
+        assert not _scanned_before(_walk_key('/video/b'), resume_key)
+        assert not _scanned_before(_walk_key('/video/b c'), resume_key)
+        assert _walk_key('/video/b/x') < _walk_key('/video/b c')
+
     def testSpecExtraction(self):
         assert (Videofile.search(Videofile.name == TESTMOV).one()
                 .video_width == 704)
@@ -93,6 +210,7 @@ class TestModel(object):
             'audio_bitrate': None, 'audio_format': None,
             'id': 5, 'last_pos': None, 'length': 23.640000000000001,
             'name': u'How.I.Met.Your.Mother.S01E04.avi', 'num_played': None,
+            'node': u'local',
             'path': os.path.abspath('tests/testdir/How.I.Met.Your.Mother.S01'),
             'playeropts': None, 'size': 1422116, 'subfilepath': None,
             'video_bitrate': None, 'video_format': u'mpeg4', 'video_fps': 25.0,
@@ -110,6 +228,26 @@ class TestModel(object):
                     assert False
         assert True
 
+    def testInfodictIsSerializable(self):
+        result = json.loads(dumps(Videofile.get(1).get_infodict()))
+        assert (result['name'] == u'The Meaning of Life.avi' and
+                isinstance(result['creation_date'], unicode))
+
+    def testInfodictInvalidKey(self):
+        try:
+            Videofile.get(1).get_infodict('name', '_sa_instance_state')
+        except KeyError:
+            return
+        assert False
+
+    def testSchemaStream(self):
+        schema = Videofile.schema()
+        out = StringIO()
+        count = schema.stream(out, schema.query('id', 'title'), 'id', 'title')
+        lines = [json.loads(l) for l in out.getvalue().splitlines()]
+        assert count == 5 and lines[0] == {u'id': 1,
+                                           u'title': u'The Meaning of Life.avi'}
+
     def testGetInvalidVideofile(self):
         assert bool(Videofile.get(12)) == False
 
@@ -138,6 +276,7 @@ class TestModel(object):
                 'audio_bitrate': None, 'audio_format': None,
                 'id': 1, 'last_pos': None, 'length': 23.640000000000001,
                 'name': u'The Meaning of Life.avi', 'num_played': None,
+                'node': u'local',
                 'path': unicode(os.path.abspath('tests/testdir')),
                 'playeropts': None, 'size': 1422116, 'subfilepath': None,
                 'video_bitrate': None, 'video_format': u'mpeg4',
@@ -0,0 +1,64 @@
+# -* coding: utf8 -*-
+
+from kinoknecht.nameparser import parse_name, parse_names, TitleIndex
+
+
+class TestNameparser(object):
+    def testSceneName(self):
+        parsed = parse_name('The.Matrix.1998.DVDRip.XviD-KG.avi')
+        assert (parsed.title == 'The Matrix' and parsed.year == 1998 and
+                parsed.tags == ['DVDRip', 'XviD'])
+
+    def testDirectorPrefix(self):
+        parsed = parse_name(u'Jean Luc Godard - Bande à part (1956).avi')
+        assert parsed.title == u'Bande à part' and parsed.year == 1956
+
+    def testYearPrefix(self):
+        parsed = parse_name('1938 - Opfergang.avi')
+        assert parsed.title == 'Opfergang' and parsed.year == 1938
+
+    def testYearInTitle(self):
+        parsed = parse_name('2001 A Space Odyssey (1968).mkv')
+        assert parsed.title == '2001 A Space Odyssey' and parsed.year == 1968
+
+    def testEpisodes(self):
+        expected = {'How.I.Met.Your.Mother.S01E04.avi': (1, 4),
+                    'How.I.Met.Your.Mother.108.avi': (1, 8),
+                    'skins1x07.avi': (1, 7),
+                    'skins_s1_e8.avi': (1, 8),
+                    'seinfeld.7x17.the_doll.avi': (7, 17)}
+        for (fname, (season, episode)) in expected.items():
+            parsed = parse_name(fname, is_episode=True)
+            assert (parsed.season, parsed.episode) == (season, episode)
+        assert parse_name('seinfeld.7x17.the_doll.avi').title == 'seinfeld'
+
+    def testBareEpisodeNumbers(self):
+        parsed = parse_name('Room 237.avi')
+        assert parsed.title == 'Room 237' and parsed.season is None
+        assert parse_name('Room 237.avi', is_episode=True).episode == 37
+
+    def testWordTags(self):
+        assert parse_name('A Proper Man.avi').title == 'A Proper Man'
+        assert parse_name('The Cam.avi').title == 'The Cam'
+        parsed = parse_name('Extended Family (2004).avi')
+        assert parsed.title == 'Extended Family' and parsed.year == 2004
+        parsed = parse_name('Brazil.1985.PROPER.DVDRip.XviD.avi')
+        assert parsed.title == 'Brazil' and parsed.tags[0] == 'PROPER'
+        parsed = parse_name('Metropolis.German.DVDRip.avi')
+        assert parsed.title == 'Metropolis' and 'German' in parsed.tags
+
+    def testPart(self):
+        parsed = parse_name('Spam and Eggs CD2.avi')
+        assert parsed.title == 'Spam and Eggs' and parsed.part == 2
+
+    def testParseNames(self):
+        names = ['Spam CD1.avi', 'Eggs.2001.avi', 'Spam CD1.avi']
+        results = parse_names(names)
+        assert [r.title for r in results] == ['Spam', 'Eggs', 'Spam']
+
+    def testTitleIndex(self):
+        index = TitleIndex([(1, u'The Matrix'), (2, u'The Meaning of Life'),
+                            (3, u'Matrix Reloaded'), (4, None)])
+        assert index.match(u'the matrix')[0][:2] == (1, u'The Matrix')
+        assert index.match(u'Meaning of Life', limit=1)[0][0] == 2
+        assert index.match(u'Spam and Eggs') == []
@@ -0,0 +1,80 @@
+from datetime import datetime
+
+from kinoknecht import config
+from kinoknecht.database import init_db, shutdown_db
+from kinoknecht.scheduler import Scheduler, ScheduledJob, in_offpeak_hours
+
+
+def spam_job(context, count):
+    for idx in range(count):
+        context.check()
+        context.progress(idx, count)
+
+
+def failing_job(context):
+    raise ValueError("Eggs!")
+
+
+class TestScheduler(object):
+    def setUp(self):
+        init_db()
+        self.scheduler = Scheduler()
+        self.scheduler.register('spam', spam_job)
+        self.scheduler.register('fail', failing_job)
+
+    def tearDown(self):
+        shutdown_db()
+
+    def run(self, jobid):
+        # Run the job synchronously, the in-memory test database can't be
+        # shared with other threads
+        job = ScheduledJob.get(jobid)
+        self.scheduler._running[jobid] = job.type
+        self.scheduler._run(jobid, self.scheduler.types[job.type],
+                            {'count': 3} if job.type == 'spam' else {})
+        return self.scheduler.status(jobid)
+
+    def testEnqueue(self):
+        jobid = self.scheduler.enqueue('spam', {'count': 3}, priority=5)
+        status = self.scheduler.status(jobid)
+        assert status['status'] == 'queued' and status['priority'] == 5
+
+    def testUnknownType(self):
+        try:
+            self.scheduler.enqueue('eggs')
+        except ValueError:
+            return
+        assert False
+
+    def testRunJob(self):
+        status = self.run(self.scheduler.enqueue('spam', {'count': 3}))
+        assert status['status'] == 'done' and status['progress'] == 1.0
+
+    def testFailingJob(self):
+        status = self.run(self.scheduler.enqueue('fail'))
+        assert status['status'] == 'failed' and 'Eggs!' in status['error']
+
+    def testCancelQueued(self):
+        jobid = self.scheduler.enqueue('spam', {'count': 3})
+        assert self.scheduler.cancel(jobid)
+        assert self.scheduler.status(jobid)['status'] == 'cancelled'
+        assert not self.scheduler.cancel(jobid)
+
+    def testCancelRunning(self):
+        jobid = self.scheduler.enqueue('spam', {'count': 3})
+        ScheduledJob.get(jobid).status = 'running'
+        assert self.scheduler.cancel(jobid)
+        assert self.run(jobid)['status'] == 'cancelled'
+
+    def testRecurringJob(self):
+        jobid = self.scheduler.enqueue('spam', {'count': 1}, interval=60)
+        self.run(jobid)
+        assert ScheduledJob.search(ScheduledJob.status == 'queued',
+                                   ScheduledJob.interval == 60).count() == 1
+
+    def testOffpeakHours(self):
+        config.offpeak_hours = (22, 6)
+        assert in_offpeak_hours(datetime(2011, 1, 1, 23))
+        assert in_offpeak_hours(datetime(2011, 1, 1, 3))
+        assert not in_offpeak_hours(datetime(2011, 1, 1, 12))
+        config.offpeak_hours = (1, 6)
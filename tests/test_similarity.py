@@ -0,0 +1,80 @@
+from kinoknecht import similarity
+from kinoknecht.cache import response_cache
+from kinoknecht.similarity import (SimilarityIndex, get_index, parse_list,
+                                   parse_runtime, parse_year)
+
+
+class TestSimilarity(object):
+    def setUp(self):
+        self.index = SimilarityIndex()
+        self.index.set(1, ['comedy'], 1983, 7.6, 107)
+        self.index.set(2, ['comedy'], 1979, 8.1, 94)
+        self.index.set(3, ['drama', 'war'], 1981, 8.3, 149)
+        self.index.set(4, ['drama', 'war'], 1979, 8.4, 153)
+
+    def testSimilar(self):
+        result = self.index.similar(1, limit=2)
+        assert result[0][0] == 2 and result[1][0] in (3, 4)
+        assert result[0][1] > result[1][1]
+
+    def testUnknownTitle(self):
+        assert self.index.similar(42) == []
+
+    def testUpdate(self):
+        self.index.set(2, ['drama', 'war'], 1979, 8.1, 94)
+        assert self.index.similar(4, limit=1)[0][0] in (2, 3)
+        assert self.index.similar(1, limit=1)[0][0] != 2
+
+    def testRemove(self):
+        self.index.remove(2)
+        assert 2 not in [x[0] for x in self.index.similar(1)]
+        assert len(self.index) == 3
+
+    def testReuseRows(self):
+        self.index.remove(2)
+        self.index.set(5, ['comedy'], 1979, 8.1, 94)
+        assert len(self.index._ids) == 4
+        assert self.index.similar(1, limit=1)[0][0] == 5
+
+    def testRefresh(self):
+        index = SimilarityIndex()
+        rows = [(1, '"[\\"Comedy\\"]"', 7.6, 1983, '["107"]', None, None),
+                (2, '"[\\"Comedy\\"]"', 8.1, 1979, None, 3, 5640.0)]
+        assert index.refresh(rows) == 2
+        assert index.refresh(rows) == 0
+        assert index.refresh(rows[:1]) == 1
+        assert index.genres == {'comedy': 0} and len(index) == 1
+
+    def testParsing(self):
+        assert parse_list('"[\\"Comedy\\", \\"War\\"]"') == ['Comedy', 'War']
+        assert parse_list(None) == []
+        assert parse_runtime('["USA:90", "120"]') == 90
+        assert parse_year(u'2005-2010') == 2005
+
+
+class TestIndexRefresh(object):
+    def setUp(self):
+        self.feature_query = similarity._feature_query
+        self.rows = [(1, '"[\\"Comedy\\"]"', 7.6, 1983, None, None, None),
+                     (2, '"[\\"Comedy\\"]"', 8.1, 1979, None, None, None)]
+        similarity._feature_query = lambda category: list(self.rows)
+        similarity._indexes.clear()
+
+    def tearDown(self):
+        similarity._feature_query = self.feature_query
+        similarity._indexes.clear()
+
+    def testBackgroundRefresh(self):
+        index = get_index('movie')
+        assert len(index) == 2
+        self.rows.append((3, '"[\\"Comedy\\"]"', 8.0, 1980, None, None,
+                          None))
+        response_cache.bump()
+        # The previous state answers until the refresh is done
+        assert get_index('movie') is index
+        thread = similarity._refreshing.get('movie')
+        if thread is not None:
+            thread.join()
+        assert len(index) == 3
+        assert (similarity._indexes['movie'][0]
+                == response_cache.generation)
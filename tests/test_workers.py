@@ -0,0 +1,74 @@
+import threading
+
+from kinoknecht.server import PoolDispatcher
+from kinoknecht.workers import Job, WorkerPool, PoolFull
+
+
+class TestWorkers(object):
+    def setUp(self):
+        self.pool = WorkerPool('test', 2, maxqueue=1)
+
+    def testJobResult(self):
+        job = self.pool.submit(Job('add', lambda x, y: x + y, (1, 2)))
+        assert job.wait(5) == 3 and job.status == 'done'
+
+    def testJobFailure(self):
+        job = self.pool.submit(Job('fail', lambda: 1 / 0))
+        try:
+            job.wait(5)
+        except ZeroDivisionError:
+            assert job.as_dict()['status'] == 'failed'
+            return
+        assert False
+
+    def testBoundedQueue(self):
+        blocker = threading.Event()
+        started = threading.Semaphore(0)
+
+        def block():
+            started.release()
+            blocker.wait()
+        try:
+            # Both workers pick up a job, then one more fits in the queue
+            for _ in range(2):
+                self.pool.submit(Job('block', block))
+                started.acquire()
+            self.pool.submit(Job('block', block))
+            try:
+                self.pool.submit(Job('block', block))
+            except PoolFull:
+                pass
+            else:
+                assert False
+        finally:
+            blocker.set()
+
+
+def generating_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    for idx in range(3):
+        yield '%d\n' % idx
+
+
+class TestPoolDispatcher(object):
+    def setUp(self):
+        self.dispatcher = PoolDispatcher(generating_app, 'db', max_streams=1)
+        self.statuses = []
+
+    def start_response(self, status, headers):
+        self.statuses.append(status)
+
+    def testStreamIsNotBuffered(self):
+        response = self.dispatcher({'PATH_INFO': '/stream/file.ndjson'},
+                                   self.start_response)
+        assert not isinstance(response, list)
+        # Only max_streams streams at once
+        self.dispatcher({'PATH_INFO': '/stream/movie.ndjson'},
+                        self.start_response)
+        assert self.statuses[-1].startswith('503')
+        assert ''.join(response) == '0\n1\n2\n'
+        response.close()
+        response = self.dispatcher({'PATH_INFO': '/stream/movie.ndjson'},
+                                   self.start_response)
+        assert ''.join(response) == '0\n1\n2\n'
+        response.close()